@@ -1,19 +1,22 @@
 # gui/app.py
 from __future__ import annotations
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
 from ..logic.allocation import allocate
-from ..logic.refill import calculate_refill, annotate_refill, _reclassify_skrymmande
+from ..logic.refill import calculate_refill, annotate_refill, index_metrics, _reclassify_skrymmande
 from ..logic.sales import compute_sales_metrics, open_sales_insights
 
 from ..io.file_readers import (
+    _read_csv_fast,
     _read_not_putaway_csv,
     normalize_not_putaway,
     normalize_saldo,
-    normalize_pick_log,
+    read_pick_log,
 )
 from ..io.excel_export import (
     open_refill_excel,
@@ -44,7 +47,33 @@ class App(ttk.Frame):
         self._create_widgets()
 
     def _log(self, msg: str, level: str = "info") -> None:
-        logprintln(self.log, msg)
+        # Tk-widgets får bara röras från huvudtråden; från arbetstråden köas anropet
+        if threading.current_thread() is threading.main_thread():
+            logprintln(self.log, msg)
+        else:
+            self.after(0, logprintln, self.log, msg)
+
+    def _update_summary_safe(self, result_df: pd.DataFrame, qty_num: pd.Series | None = None) -> None:
+        try:
+            self.update_summary_table(result_df, qty_num)
+        except Exception as e:
+            self._log(f"Sammanställningen kunde inte uppdateras: {e}")
+
+    def _set_busy(self, busy: bool) -> None:
+        """Låser kör-, påfyllnings- och försäljningsknapparna medan arbetstråden skriver om indata/resultat."""
+        state = "disabled" if busy else "normal"
+        self.run_btn.configure(state=state)
+        self.open_sales_btn.configure(state=state)
+        if busy:
+            self.open_refill_btn.configure(state="disabled")
+        elif isinstance(self._last_refill_hp_df, pd.DataFrame) or isinstance(self._last_refill_autostore_df, pd.DataFrame):
+            self.open_refill_btn.configure(state="normal")
+
+    @staticmethod
+    def _qty_numeric(result_df: pd.DataFrame) -> pd.Series | None:
+        """Resultatets antal som tal (None om antal-kolumn saknas) – tolkas en gång per körning."""
+        qty_col = find_col(result_df, ORDER_SCHEMA["qty"], required=False, default=None)
+        return pd.to_numeric(result_df[qty_col], errors="coerce") if qty_col else None
 
     def _create_widgets(self) -> None:
         self.columnconfigure(1, weight=1)
@@ -157,11 +186,13 @@ class App(ttk.Frame):
     def open_refill_in_excel(self):
         if isinstance(self._last_refill_hp_df, pd.DataFrame) or isinstance(self._last_refill_autostore_df, pd.DataFrame):
             try:
-                hp = self._last_refill_hp_df.copy() if isinstance(self._last_refill_hp_df, pd.DataFrame) else pd.DataFrame()
-                asr = self._last_refill_autostore_df.copy() if isinstance(self._last_refill_autostore_df, pd.DataFrame) else pd.DataFrame()
+                hp = self._last_refill_hp_df if isinstance(self._last_refill_hp_df, pd.DataFrame) else pd.DataFrame()
+                asr = self._last_refill_autostore_df if isinstance(self._last_refill_autostore_df, pd.DataFrame) else pd.DataFrame()
+                # annotate_refill bygger nya ramar; utan metrik skickas de sparade ramarna direkt
                 if isinstance(self._sales_metrics_df, pd.DataFrame) and not self._sales_metrics_df.empty:
-                    hp = annotate_refill(hp, self._sales_metrics_df)
-                    asr = annotate_refill(asr, self._sales_metrics_df)
+                    sm = index_metrics(self._sales_metrics_df)
+                    hp = annotate_refill(hp, sm)
+                    asr = annotate_refill(asr, sm)
                 open_refill_excel(hp, asr)
             except Exception as e:
                 messagebox.showerror(APP_TITLE, f"Kunde inte öppna påfyllningspallar i Excel:\n{e}")
@@ -180,7 +211,7 @@ class App(ttk.Frame):
             auto_path = self.automation_var.get().strip()
             if auto_path:
                 try:
-                    auto_raw = pd.read_csv(auto_path, dtype=str, sep=None, engine="python")
+                    auto_raw = _read_csv_fast(auto_path)
                     auto_raw = _clean_columns(auto_raw)
                     self._saldo_norm = normalize_saldo(auto_raw)
                     self._log(f"Saldo inläst för sales: {len(self._saldo_norm)} rader.")
@@ -192,7 +223,7 @@ class App(ttk.Frame):
             buffer_path = self.buffer_var.get().strip()
             if buffer_path:
                 try:
-                    buf_raw = pd.read_csv(buffer_path, dtype=str, sep=None, engine="python")
+                    buf_raw = _read_csv_fast(buffer_path)
                     self._buffer_raw = _clean_columns(buf_raw)
                     self._log(f"Buffertpallar inläst för sales: {len(self._buffer_raw)} rader.")
                 except Exception as e:
@@ -200,19 +231,7 @@ class App(ttk.Frame):
 
         # Läs plockloggen robust
         try:
-            if path.lower().endswith(".xlsx"):
-                xls = pd.ExcelFile(path)
-                df_raw = xls.parse(xls.sheet_names[0], dtype=str)
-            else:
-                try:
-                    df_raw = pd.read_csv(path, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
-                except Exception:
-                    try:
-                        df_raw = pd.read_csv(path, dtype=str, sep="\t", engine="python", encoding="utf-8-sig")
-                    except Exception:
-                        df_raw = pd.read_csv(path, dtype=str, sep=";", engine="python", encoding="utf-8-sig")
-            df_raw = _clean_columns(df_raw)
-            df_norm = normalize_pick_log(df_raw)
+            df_norm = read_pick_log(path)  # läser bara M, N, antal och datum
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Kunde inte läsa/normalisera plockloggen:\n{e}")
             return
@@ -222,16 +241,17 @@ class App(ttk.Frame):
             sd  = self._saldo_norm  if isinstance(self._saldo_norm,  pd.DataFrame) else None
             buf = self._buffer_raw  if isinstance(self._buffer_raw,  pd.DataFrame) else None
             metrics = compute_sales_metrics(df_norm, saldo_norm=sd, buffer_df=buf)
-            self._sales_metrics_df = metrics.copy()
+            self._sales_metrics_df = metrics
 
             # Logg: storlek + enkel träffbild
             n_art = int(metrics["Artikelnummer"].nunique()) if "Artikelnummer" in metrics.columns else len(metrics)
             # kandidater som slutar på "1"
-            got_1 = int(metrics["Plockplats"].astype(str).str.endswith("1").sum()) if "Plockplats" in metrics.columns else 0
-            # EH-kandidater (Endast E / Endast E & H)
+            got_1 = int(metrics["Plockplats"].astype("string").str.endswith("1").fillna(False).sum()) if "Plockplats" in metrics.columns else 0
+            # EH-kandidater (Endast E / Endast E & H) – rena jämförelser, ingen regex
             if "ZonSet" in metrics.columns:
-                only_e  = metrics["ZonSet"].fillna("").str.fullmatch(r"E", na=False).sum()
-                only_eh = metrics["ZonSet"].fillna("").str.fullmatch(r"EH|HE", na=False).sum()
+                zs = metrics["ZonSet"].fillna("")
+                only_e  = int(zs.eq("E").sum())
+                only_eh = int(zs.eq("EH").sum())  # ZonSet är sorterad (se open_sales_insights)
             else:
                 only_e = only_eh = 0
 
@@ -247,14 +267,19 @@ class App(ttk.Frame):
             messagebox.showerror(APP_TITLE, f"Fel vid beräkning/öppning av försäljningsinsikter:\n{e}")
 
     # -------- Summering --------
-    def update_summary_table(self, result_df: pd.DataFrame) -> None:
+    def update_summary_table(self, result_df: pd.DataFrame, qty_num: pd.Series | None = None) -> None:
+        # Rader och kolli per Källtyp i ett enda groupby-pass
+        try:
+            q = qty_num if qty_num is not None else self._qty_numeric(result_df)
+            if q is None:
+                q = pd.Series(0.0, index=result_df.index)
+            grp = q.groupby(result_df["Källtyp"], observed=True).agg(["size", "sum"])
+        except Exception:
+            grp = None
         for ktyp in ("HELPALL", "AUTOSTORE", "HUVUDPLOCK", "SKRYMMANDE"):
-            try:
-                sub = result_df[result_df.get("Källtyp", "") == ktyp]
-                row_count = int(len(sub))
-                qty_col = find_col(result_df, ORDER_SCHEMA["qty"], required=False, default=None)
-                kolli = float(pd.to_numeric(sub[qty_col], errors="coerce").sum()) if qty_col and not sub.empty else 0.0
-            except Exception:
+            if grp is not None and ktyp in grp.index:
+                row_count, kolli = int(grp.at[ktyp, "size"]), float(grp.at[ktyp, "sum"])
+            else:
                 row_count, kolli = 0, 0.0
             if ktyp == "HELPALL":
                 row_text = f"{row_count} pallar"
@@ -274,15 +299,15 @@ class App(ttk.Frame):
 
     # -------- Efter-allokering extra logg --------
     def _log_post_allocation(self, result: pd.DataFrame, near_instead: pd.DataFrame,
-                             hp_df: pd.DataFrame, as_df: pd.DataFrame) -> None:
+                             hp_df: pd.DataFrame, as_df: pd.DataFrame,
+                             qty_num: pd.Series | None = None) -> None:
         self._log(f"Auto-refill klart: HP {len(hp_df)} rader, AUTOSTORE {len(as_df)} rader (cachad).")
 
         # Summering per zon
         try:
-            qty_col = find_col(result, ORDER_SCHEMA["qty"], required=False, default=None)
-            if qty_col and ("Zon (beräknad)" in result.columns):
-                sums = (pd.to_numeric(result[qty_col], errors="coerce")
-                          .groupby(result["Zon (beräknad)"]).sum())
+            q = qty_num if qty_num is not None else self._qty_numeric(result)
+            if q is not None and ("Zon (beräknad)" in result.columns):
+                sums = q.groupby(result["Zon (beräknad)"]).sum()
                 self._log("\nSummering per zon:")
                 for z in ["A", "H", "R", "S"]:
                     val = int(round(float(sums.get(z, 0)))) if hasattr(sums, "get") else 0
@@ -309,22 +334,45 @@ class App(ttk.Frame):
             messagebox.showerror(APP_TITLE, "Välj både beställningsfil och buffertfil.")
             return
 
+        # Inläsning + beräkning i arbetstråd så att GUI:t inte fryser; Tk-anrop köas via after()
+        self._set_busy(True)
+        threading.Thread(
+            target=self._run_allocation_worker,
+            args=(orders_path, buffer_path, automation_path, not_putaway_path),
+            daemon=True,
+        ).start()
+
+    def _run_allocation_worker(self, orders_path: str, buffer_path: str,
+                               automation_path: str, not_putaway_path: str) -> None:
+        try:
+            self._allocation_pipeline(orders_path, buffer_path, automation_path, not_putaway_path)
+        finally:
+            self.after(0, self._set_busy, False)
+
+    def _allocation_pipeline(self, orders_path: str, buffer_path: str,
+                             automation_path: str, not_putaway_path: str) -> None:
         try:
             self._log("Läser in filer...")
-            orders_raw = pd.read_csv(orders_path, dtype=str, sep=None, engine="python")
-            buffer_raw = pd.read_csv(buffer_path, dtype=str, sep=None, engine="python")
+            # Filerna är oberoende → läs dem parallellt (CSV-parsningen släpper GIL)
+            with ThreadPoolExecutor(max_workers=4) as ex:
+                f_orders = ex.submit(_read_csv_fast, orders_path)
+                f_buffer = ex.submit(_read_csv_fast, buffer_path)
+                f_npu = ex.submit(_read_not_putaway_csv, not_putaway_path) if not_putaway_path else None
+                f_auto = ex.submit(_read_csv_fast, automation_path) if automation_path else None
+            orders_raw = f_orders.result()
+            buffer_raw = f_buffer.result()
 
             if not not_putaway_path:
                 self._not_putaway_raw = None
                 self._not_putaway_norm = None
             else:
-                npu_raw = _read_not_putaway_csv(not_putaway_path)
+                npu_raw = f_npu.result()
                 self._not_putaway_raw = npu_raw.copy()
                 self._not_putaway_norm = normalize_not_putaway(npu_raw)
                 self._log(f"'Ej inlagrade' inläst ({len(self._not_putaway_norm)} rader).")
 
             if automation_path:
-                auto_raw = pd.read_csv(automation_path, dtype=str, sep=None, engine="python")
+                auto_raw = f_auto.result()
                 self._saldo_norm = normalize_saldo(_clean_columns(auto_raw))
             else:
                 self._saldo_norm = None
@@ -332,7 +380,7 @@ class App(ttk.Frame):
             self._orders_raw = _clean_columns(orders_raw)
             self._buffer_raw = _clean_columns(buffer_raw)
         except Exception as e:
-            messagebox.showerror(APP_TITLE, f"Kunde inte läsa CSV-filerna:\n{e}")
+            self.after(0, messagebox.showerror, APP_TITLE, f"Kunde inte läsa CSV-filerna:\n{e}")
             return
 
         try:
@@ -343,14 +391,13 @@ class App(ttk.Frame):
             self._log("Skapar resultat i minnet...")
 
             near_instead = near[near.get("Gäller (INSTEAD R/A)", False) == True].copy() if "Gäller (INSTEAD R/A)" in near.columns else near.iloc[0:0].copy()
-            self.last_result_df = result.copy()
-            self.last_nearmiss_instead_df = near_instead.copy()
-            self._result_df = result.copy()
+            # Vyerna läser bara ramarna – ingen kopia behövs
+            self.last_result_df = result
+            self.last_nearmiss_instead_df = near_instead
+            self._result_df = result
 
-            try:
-                self.update_summary_table(result)
-            except Exception:
-                pass
+            qty_num = self._qty_numeric(result)  # delas av summering och zon-logg
+            self.after(0, self._update_summary_safe, result, qty_num)
 
             # Auto-refill
             try:
@@ -362,13 +409,15 @@ class App(ttk.Frame):
                 )
                 self._last_refill_hp_df = hp_df
                 self._last_refill_autostore_df = as_df
-                self._log_post_allocation(result, near_instead, hp_df, as_df)
+                self._log_post_allocation(result, near_instead, hp_df, as_df, qty_num)
             except Exception as e:
                 self._log(f"Refill kunde inte beräknas: {e}")
 
-            self.open_result_btn.configure(state="normal")
-            self.open_nearmiss_btn.configure(state="normal" if not near_instead.empty else "disabled")
-            self.open_refill_btn.configure(state="normal")
+            def _enable_buttons():
+                self.open_result_btn.configure(state="normal")
+                self.open_nearmiss_btn.configure(state="normal" if not near_instead.empty else "disabled")
+                self.open_refill_btn.configure(state="normal")
+            self.after(0, _enable_buttons)
 
         except Exception as e:
-            messagebox.showerror(APP_TITLE, f"Allokering misslyckades:\n{e}")
+            self.after(0, messagebox.showerror, APP_TITLE, f"Allokering misslyckades:\n{e}")
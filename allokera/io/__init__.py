@@ -11,6 +11,7 @@ from .file_readers import (
     normalize_not_putaway,
     normalize_saldo,
     normalize_pick_log,
+    read_pick_log,
 )
 
 from .excel_export import (
@@ -25,6 +26,7 @@ __all__ = [
     "ORDER_SCHEMA", "BUFFER_SCHEMA", "NOT_PUTAWAY_SCHEMA", "SALDO_SCHEMA", "PICK_LOG_SCHEMA",
     # Läs/normalize
     "_read_not_putaway_csv", "normalize_not_putaway", "normalize_saldo", "normalize_pick_log",
+    "read_pick_log",
     # Export
     "open_sales_excel", "open_refill_excel", "open_allocated_excel", "open_nearmiss_excel",
 ]
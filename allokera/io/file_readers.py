@@ -1,23 +1,101 @@
 # io/file_readers.py
 from __future__ import annotations
+import csv
+from typing import List
 import pandas as pd
 import numpy as np
 from .schemas import NOT_PUTAWAY_SCHEMA, SALDO_SCHEMA, PICK_LOG_SCHEMA
-from ..utils.common import _clean_columns, smart_to_datetime, to_num, find_col
+from ..utils.common import _clean_columns, smart_to_datetime, to_num_series, find_col, ColumnResolver
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow är valfritt – CSV läses då med pandas C-motor
+    pa = None
+
+try:
+    import python_calamine  # noqa: F401
+    # calamine-motorn finns i pandas från 2.2
+    _XLSX_ENGINE = "calamine" if tuple(int(x) for x in pd.__version__.split(".")[:2]) >= (2, 2) else None
+except ImportError:  # python-calamine är valfritt – xlsx läses då med openpyxl (read_only)
+    _XLSX_ENGINE = None
+
+# pandas standardlista för NA-strängar; pyarrow-vägen ska ge samma NaN som read_csv
+_CSV_NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+                  "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+def _header_names(header: str, sep: str) -> List[str]:
+    return next(csv.reader([header.lstrip("\ufeff")], delimiter=sep))
+
+def _sniff_header(path: str, encoding: str | None) -> tuple[str, str]:
+    """(rubrikrad, avgränsare) – avgränsaren sniffas ur första raden som sep=None gör. Kastar csv.Error."""
+    with open(path, "r", encoding=encoding or "utf-8", errors="replace", newline="") as f:
+        header = f.readline()
+    return header, csv.Sniffer().sniff(header).delimiter
+
+def _read_csv_arrow(path: str, sep: str, header: str, encoding: str | None,
+                    usecols: List[int] | None = None) -> pd.DataFrame:
+    """Flertrådad CSV-läsning via pyarrow, alla kolumner som text. Kastar om filen inte
+    kan läsas likadant som med read_csv (dubbla/tomma rubriker, annan kodning, trasiga rader)."""
+    if (encoding or "utf-8").lower().replace("_", "-") not in ("utf-8", "utf8", "utf-8-sig"):
+        raise ValueError("pyarrow-vägen stöder bara UTF-8")
+    names = _header_names(header, sep)
+    if not names or "" in names or len(set(names)) != len(names):
+        raise ValueError("rubrikraden kräver pandas namngivning")
+    include = names if usecols is None else [names[i] for i in sorted(usecols)]
+    table = pa_csv.read_csv(
+        path,
+        parse_options=pa_csv.ParseOptions(delimiter=sep, newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(column_types={n: pa.string() for n in include},
+                                              include_columns=include,
+                                              strings_can_be_null=True, null_values=_CSV_NA_VALUES),
+    )
+    if table.column_names != include:
+        raise ValueError("rubrikraden tolkades olika")
+    df = table.to_pandas()
+    for name, col in zip(include, table.columns):
+        if col.null_count:  # None → NaN som i read_csv
+            df[name] = df[name].fillna(np.nan)
+    return df
+
+def _read_csv_fast(path: str, encoding: str | None = None, usecols: List[int] | None = None) -> pd.DataFrame:
+    """CSV som text. Avgränsaren sniffas ur första raden (som sep=None gör); läses sedan
+    med pyarrow om det finns, annars C-motorn. Python-motorn bara om sniffningen misslyckas.
+    usecols: kolumnpositioner att läsa (i filordning), None = alla."""
+    try:
+        header, sep = _sniff_header(path, encoding)
+    except csv.Error:
+        return pd.read_csv(path, dtype=str, sep=None, engine="python", encoding=encoding, usecols=usecols)
+    if pa is not None:
+        try:
+            return _read_csv_arrow(path, sep, header, encoding, usecols)
+        except Exception:
+            pass
+    return pd.read_csv(path, dtype=str, sep=sep, engine="c", encoding=encoding, usecols=usecols)
+
+def _read_excel_fast(path: str, usecols: List[int] | None = None, nrows: int | None = None) -> pd.DataFrame:
+    """Första bladet som text. calamine (Rust) om det finns, annars openpyxl i read_only-läge."""
+    if _XLSX_ENGINE:
+        try:
+            return pd.read_excel(path, sheet_name=0, dtype=str, engine=_XLSX_ENGINE, usecols=usecols, nrows=nrows)
+        except Exception:
+            pass
+    # pandas öppnar redan boken med read_only/data_only; engine_kwargs finns först i pandas 2.1
+    return pd.read_excel(path, sheet_name=0, dtype=str, engine="openpyxl", usecols=usecols, nrows=nrows)
 
 def _read_not_putaway_csv(path: str) -> pd.DataFrame:
     try:
-        df = pd.read_csv(path, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+        df = _read_csv_fast(path, encoding="utf-8-sig")
         if df.shape[1] == 1 and len(df):
             first = str(df.iloc[0, 0])
             if "\t" in first:
-                df = pd.read_csv(path, dtype=str, sep="\t", engine="python", encoding="utf-8-sig")
+                df = pd.read_csv(path, dtype=str, sep="\t", encoding="utf-8-sig")
         return _clean_columns(df)
     except Exception:
-        return _clean_columns(pd.read_csv(path, dtype=str, sep="\t", engine="python", encoding="utf-8-sig"))
+        return _clean_columns(pd.read_csv(path, dtype=str, sep="\t", encoding="utf-8-sig"))
 
 def normalize_not_putaway(df_raw: pd.DataFrame) -> pd.DataFrame:
-    df = df_raw.copy()
+    df = df_raw  # läses bara; ut-ramen byggs nedan
     def col(key: str, required: bool, default=None) -> str:
         return find_col(df, NOT_PUTAWAY_SCHEMA[key], required=required, default=default)
     art_col  = col("artikel", True)
@@ -31,19 +109,17 @@ def normalize_not_putaway(df_raw: pd.DataFrame) -> pd.DataFrame:
     out = pd.DataFrame({
         "Artikel": df[art_col].astype(str).str.strip(),
         "Namn":    df[name_col].astype(str).str.strip() if name_col else "",
-        "Antal":   df[qty_col].map(to_num).astype(float),
-        "Status":  pd.to_numeric(df[st_col], errors="coerce") if st_col else pd.Series([np.nan]*len(df)),
-        "Pall nr": df[pall_col].astype(str) if pall_col else "",
-        "SSCC":    df[sscc_col].astype(str) if sscc_col else "",
+        "Antal":   to_num_series(df[qty_col]),
+        "Status":  pd.to_numeric(df[st_col], errors="coerce") if st_col else pd.Series(np.nan, index=df.index),
+        "Pall nr": df[pall_col].astype(str).str.strip() if pall_col else "",
+        "SSCC":    df[sscc_col].astype(str).str.strip() if sscc_col else "",
         "Ändrad":  smart_to_datetime(df[chg_col]) if chg_col else pd.NaT,
         "Utgång":  smart_to_datetime(df[exp_col]) if exp_col else pd.NaT,
     })
-    for c in ["Namn","Pall nr","SSCC"]:
-        if c in out.columns: out[c] = out[c].fillna("").astype(str).str.strip()
     return out
 
 def normalize_saldo(df_raw: pd.DataFrame) -> pd.DataFrame:
-    df = _clean_columns(df_raw.copy())
+    df = _clean_columns(df_raw.copy(deep=False))  # grund kopia: bara kolumnnamnen tvättas, data delas
     def col(key: str, required: bool, default=None) -> str:
         from .schemas import SALDO_SCHEMA
         from ..utils.common import find_col
@@ -55,24 +131,31 @@ def normalize_saldo(df_raw: pd.DataFrame) -> pd.DataFrame:
         return pd.DataFrame(columns=["Artikel", "Plocksaldo", "Plockplats"])
     out = pd.DataFrame({
         "Artikel": df[art_col].astype(str).str.strip(),
-        "Plocksaldo": pd.to_numeric(df[saldo_col].map(to_num), errors="coerce").fillna(0.0),
-        "Plockplats": (df[plats_col].astype(str).str.strip() if plats_col else pd.Series([""]*len(df))),
+        "Plocksaldo": to_num_series(df[saldo_col]),
+        "Plockplats": (df[plats_col].astype(str).str.strip() if plats_col else ""),
     })
-    agg = (out.groupby("Artikel", as_index=False)
-              .agg({"Plocksaldo":"sum","Plockplats":lambda s: next((x for x in s if isinstance(x,str) and x.strip()), "")}))
+    # Summa saldo + första icke-tomma plockplats per artikel (first() hoppar över NaN)
+    plats = out["Plockplats"]
+    plats = plats.where(plats.notna() & plats.astype(str).str.strip().ne(""))
+    g = out.groupby("Artikel")
+    agg = pd.DataFrame({
+        "Plocksaldo": g["Plocksaldo"].sum(),
+        "Plockplats": plats.groupby(out["Artikel"]).first().fillna(""),
+    }).reset_index()
     return agg
 
-def normalize_pick_log(df_raw: pd.DataFrame) -> pd.DataFrame:
-    df = _clean_columns(df_raw.copy())
+def normalize_pick_log(df_raw: pd.DataFrame, art_col: str | None = None, name_col: str | None = None) -> pd.DataFrame:
+    df = _clean_columns(df_raw.copy(deep=False))  # grund kopia: bara kolumnnamnen tvättas, data delas
 
-    # Här tar vi fasta kolumner:
+    # Här tar vi fasta kolumner (om de inte redan är utpekade, se read_pick_log):
     # Kolumn M = Artikelnummer (index 12 om 0-baserat)
     # Kolumn N = Artikel (index 13 om 0-baserat)
-    try:
-        art_col = df.columns[12]  # M
-        name_col = df.columns[13] # N
-    except Exception as e:
-        raise RuntimeError(f"Kunde inte hitta kolumner M/N i plocklogg: {e}")
+    if art_col is None or name_col is None:
+        try:
+            art_col = df.columns[12]  # M
+            name_col = df.columns[13] # N
+        except Exception as e:
+            raise RuntimeError(f"Kunde inte hitta kolumner M/N i plocklogg: {e}")
 
     # Hämta övriga viktiga kolumner (antal, datum) via schema
     qty_col = find_col(df, PICK_LOG_SCHEMA["antal"], required=True)
@@ -81,7 +164,51 @@ def normalize_pick_log(df_raw: pd.DataFrame) -> pd.DataFrame:
     out = pd.DataFrame({
         "Artikelnummer": df[art_col].astype(str).str.strip(),
         "Artikel": df[name_col].astype(str).str.strip(),
-        "Plockat": pd.to_numeric(df[qty_col].map(to_num), errors="coerce").fillna(0.0).astype(float),
+        "Plockat": to_num_series(df[qty_col]),
         "Datum": smart_to_datetime(df[dt_col]),
     })
     return out
+
+def _pick_log_usecols(names) -> List[int] | None:
+    """Positionerna normalize_pick_log behöver (M, N, antal, datum) ur rubriken, sorterade; None om de inte kan avgöras."""
+    names = [str(c).replace("\ufeff", "").strip() for c in names]
+    if len(names) < 14:
+        return None
+    cols = ColumnResolver(pd.DataFrame(columns=names))
+    qty_col = cols.resolve(PICK_LOG_SCHEMA["antal"], required=False)
+    dt_col = cols.resolve(PICK_LOG_SCHEMA["datum"], required=False)
+    if qty_col is None or dt_col is None:
+        return None
+    return sorted({12, 13, names.index(qty_col), names.index(dt_col)})
+
+def _read_pick_log_full(path: str) -> pd.DataFrame:
+    if path.lower().endswith(".xlsx"):
+        return _read_excel_fast(path)
+    try:
+        return _read_csv_fast(path, encoding="utf-8-sig")
+    except Exception:
+        try:
+            return pd.read_csv(path, dtype=str, sep="\t", encoding="utf-8-sig")
+        except Exception:
+            return pd.read_csv(path, dtype=str, sep=";", encoding="utf-8-sig")
+
+def read_pick_log(path: str) -> pd.DataFrame:
+    """Läser och normaliserar plockloggen (CSV/XLSX). Rubriken läses först så att bara
+    kolumnerna M, N, antal och datum tolkas; annars läses hela filen som tidigare."""
+    xlsx = path.lower().endswith(".xlsx")
+    try:
+        if xlsx:
+            use = _pick_log_usecols(_read_excel_fast(path, nrows=0).columns)
+        else:
+            header, sep = _sniff_header(path, "utf-8-sig")
+            use = _pick_log_usecols(_header_names(header, sep))
+    except Exception:
+        use = None
+    if use is not None:
+        try:
+            df = _read_excel_fast(path, usecols=use) if xlsx else _read_csv_fast(path, encoding="utf-8-sig", usecols=use)
+            df = _clean_columns(df)
+            return normalize_pick_log(df, art_col=df.columns[use.index(12)], name_col=df.columns[use.index(13)])
+        except Exception:
+            pass
+    return normalize_pick_log(_clean_columns(_read_pick_log_full(path)))
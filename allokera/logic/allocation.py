@@ -1,224 +1,264 @@
 # logic/allocation.py
 from __future__ import annotations
-from typing import Deque, Dict, List, Tuple
+from typing import Tuple
+import numpy as np
 import pandas as pd
-from collections import defaultdict, deque
 
 from ..io.schemas import ORDER_SCHEMA, BUFFER_SCHEMA
-from ..utils.common import find_col, smart_to_datetime, to_num
+from ..utils.common import ColumnResolver, smart_to_datetime, to_num_series
 from ..config.constants import ALLOC_BUFFER_STATUSES, NEAR_MISS_PCT, INVALID_LOC_PREFIXES, INVALID_LOC_EXACT
 
+try:
+    from numba import njit
+except ImportError:  # numba är valfritt – kärnan körs då som vanlig Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+KIND_HELPALL, KIND_AUTOSTORE, KIND_HUVUDPLOCK = 0, 1, 2
+KIND_NAMES = ("HELPALL", "AUTOSTORE", "HUVUDPLOCK")
+KIND_ZONES = ("H", "R", "A")
+# SKRYMMANDE sätts i efterhand av refill._reclassify_skrymmande
+KIND_CATEGORIES = KIND_NAMES + ("SKRYMMANDE",)
+
+
+@njit(cache=True)
+def _grow(arr):
+    out = np.empty(arr.shape[0] * 2, arr.dtype)
+    out[:arr.shape[0]] = arr
+    return out
+
+
+@njit(cache=True)
+def _drain(order_codes, order_qtys, pal_qty, pal_head, pal_end, bin_qty, bin_head, bin_end, near_pct):
+    """FIFO-dränering Helpall → AutoStore → Huvudplock över SoA-arrayer.
+
+    pal_qty/bin_qty och head-arrayerna muteras. Returnerar parallella
+    utdata-arrayer (orderindex, källindex, kvantitet, typ), near-miss-arrayer
+    (orderindex, pallindex, behov) samt per order 1/0 för "INSTEAD R/A"
+    (-1 = orderraden hoppades över). Near-miss-flaggan hör därmed alltid till
+    den orderrad som registrerade den.
+    """
+    n_orders = order_codes.shape[0]
+    cap = n_orders + pal_qty.shape[0] + bin_qty.shape[0]
+    out_order = np.empty(cap, np.int64)
+    out_src = np.empty(cap, np.int64)
+    out_taken = np.empty(cap, np.float64)
+    out_kind = np.empty(cap, np.uint8)
+    n = 0
+    # Near-miss: normalt högst en per pall → starta där, väx bara vid behov
+    nm_cap = max(16, pal_qty.shape[0])
+    nm_order = np.empty(nm_cap, np.int64)
+    nm_src = np.empty(nm_cap, np.int64)
+    nm_need = np.empty(nm_cap, np.float64)
+    nm_n = 0
+    instead = np.full(n_orders, -1, np.int8)
+
+    for o in range(n_orders):
+        need = order_qtys[o]
+        if need <= 0:
+            continue
+        c = order_codes[o]
+        any_helpall = False
+        any_other = False
+        # Artiklar utan (kvarvarande) buffert går direkt till huvudplock
+        if c >= 0 and (pal_head[c] < pal_end[c] or bin_head[c] < bin_end[c]):
+            # 1) HELPALL – hela pallar ≤ behov; för stora pallar ligger kvar
+            i = pal_head[c]
+            end = pal_end[c]
+            while i < end and need > 0:
+                q = pal_qty[i]
+                if q > 0:
+                    diff = q - need
+                    if diff <= 0:
+                        out_order[n] = o; out_src[n] = i; out_taken[n] = q; out_kind[n] = 0
+                        n += 1
+                        pal_qty[i] = 0.0
+                        need -= q
+                        any_helpall = True
+                    elif diff <= near_pct * need:  # need > 0 här → ingen division behövs
+                        if nm_n == nm_order.shape[0]:
+                            nm_order = _grow(nm_order); nm_src = _grow(nm_src); nm_need = _grow(nm_need)
+                        nm_order[nm_n] = o; nm_src[nm_n] = i; nm_need[nm_n] = need
+                        nm_n += 1
+                i += 1
+            h = pal_head[c]
+            while h < end and pal_qty[h] <= 0:
+                h += 1
+            pal_head[c] = h
+
+            # 2) AUTOSTORE – bryts fritt
+            h = bin_head[c]
+            end = bin_end[c]
+            while h < end and need > 0:
+                take = min(bin_qty[h], need)
+                out_order[n] = o; out_src[n] = h; out_taken[n] = take; out_kind[n] = 1
+                n += 1
+                bin_qty[h] -= take
+                need -= take
+                any_other = True
+                if bin_qty[h] <= 0:
+                    h += 1
+            bin_head[c] = h
+
+        # 3) HUVUDPLOCK
+        if need > 0:
+            out_order[n] = o; out_src[n] = -1; out_taken[n] = need; out_kind[n] = 2
+            n += 1
+            any_other = True
+
+        instead[o] = 1 if (not any_helpall and any_other) else 0
+
+    return (out_order[:n], out_src[:n], out_taken[:n], out_kind[:n],
+            nm_order[:nm_n], nm_src[:nm_n], nm_need[:nm_n], instead)
+
+
+def _status_to_num(status: pd.Series) -> pd.Series:
+    """Status som tal. Regex-extrahering (t.ex. '30 - Klar') bara för värden som inte är rent numeriska."""
+    s = status.astype(str).str.strip()
+    num = pd.to_numeric(s, errors="coerce")
+    bad = num.isna() & status.notna()
+    if bad.any():
+        num[bad] = pd.to_numeric(s[bad].str.extract(r"(-?\d+)")[0], errors="coerce")
+    return num
+
 def allocate(orders_raw: pd.DataFrame, buffer_raw: pd.DataFrame, log=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
     def _log(msg: str):
         if log: log(msg)
 
     # Kolumnupptäckt via schema
-    order_article_col = find_col(orders_raw, ORDER_SCHEMA["artikel"])
-    order_qty_col     = find_col(orders_raw, ORDER_SCHEMA["qty"])
-    order_id_col      = find_col(orders_raw, ORDER_SCHEMA["ordid"], required=False, default=None)
-    order_line_col    = find_col(orders_raw, ORDER_SCHEMA["radid"], required=False, default=None)
-    order_status_col  = find_col(orders_raw, ORDER_SCHEMA["status"], required=False, default=None)
-
-    buff_article_col  = find_col(buffer_raw, BUFFER_SCHEMA["artikel"])
-    buff_qty_col      = find_col(buffer_raw, BUFFER_SCHEMA["qty"])
-    buff_loc_col      = find_col(buffer_raw, BUFFER_SCHEMA["loc"])
-    buff_dt_col       = find_col(buffer_raw, BUFFER_SCHEMA["dt"], required=False, default=None)
-    buff_id_col       = find_col(buffer_raw, BUFFER_SCHEMA["id"], required=False, default=None)
-    buff_status_col   = find_col(buffer_raw, BUFFER_SCHEMA["status"], required=False, default=None)
+    res_o = ColumnResolver(orders_raw)
+    order_article_col = res_o.resolve(ORDER_SCHEMA["artikel"])
+    order_qty_col     = res_o.resolve(ORDER_SCHEMA["qty"])
+    order_id_col      = res_o.resolve(ORDER_SCHEMA["ordid"], required=False, default=None)
+    order_line_col    = res_o.resolve(ORDER_SCHEMA["radid"], required=False, default=None)
+    order_status_col  = res_o.resolve(ORDER_SCHEMA["status"], required=False, default=None)
+
+    res_b = ColumnResolver(buffer_raw)
+    buff_article_col  = res_b.resolve(BUFFER_SCHEMA["artikel"])
+    buff_qty_col      = res_b.resolve(BUFFER_SCHEMA["qty"])
+    buff_loc_col      = res_b.resolve(BUFFER_SCHEMA["loc"])
+    buff_dt_col       = res_b.resolve(BUFFER_SCHEMA["dt"], required=False, default=None)
+    buff_id_col       = res_b.resolve(BUFFER_SCHEMA["id"], required=False, default=None)
+    buff_status_col   = res_b.resolve(BUFFER_SCHEMA["status"], required=False, default=None)
 
     _log(f"Order-kolumner: Artikel='{order_article_col}', Antal='{order_qty_col}', OrderId='{order_id_col}', Rad='{order_line_col}', Status='{order_status_col}'")
     _log(f"Buffert-kolumner: Artikel='{buff_article_col}', Antal='{buff_qty_col}', Lagerplats='{buff_loc_col}', Tid='{buff_dt_col}', ID='{buff_id_col}', Status='{buff_status_col}'")
 
-    # Normalisera orders
-    orders = orders_raw.copy()
-    orders["_artikel"] = orders[order_article_col].astype(str).str.strip()
-    orders["_qty"] = orders[order_qty_col].map(to_num).astype(float)
-    orders["_order_id"] = orders[order_id_col].astype(str) if order_id_col and order_id_col in orders.columns else ""
-    orders["_order_line"] = orders[order_line_col].astype(str) if order_line_col and order_line_col in orders.columns else orders.index.astype(str)
+    # Normalisera orders – smal arbetsram; orders_raw kopieras inte
+    orders = pd.DataFrame({
+        "_artikel": orders_raw[order_article_col].astype(str).str.strip(),
+        "_qty": to_num_series(orders_raw[order_qty_col]),
+        "_order_id": orders_raw[order_id_col].astype(str) if order_id_col and order_id_col in orders_raw.columns else "",
+        "_order_line": orders_raw[order_line_col].astype(str) if order_line_col and order_line_col in orders_raw.columns else orders_raw.index.astype(str).to_numpy(),
+        "_row": np.arange(len(orders_raw)),
+    }, index=orders_raw.index)
 
     # Ignorera Status=35
-    if order_status_col and order_status_col in orders.columns:
-        _status_str = orders[order_status_col].astype(str).str.strip()
-        _status_num = pd.to_numeric(_status_str.str.extract(r"(-?\d+)")[0], errors="coerce")
+    if order_status_col and order_status_col in orders_raw.columns:
+        _status_num = _status_to_num(orders_raw[order_status_col])
         _before = len(orders)
-        orders = orders[~(_status_num == 35)].copy()
+        orders = orders[~(_status_num == 35)]
         _removed = _before - len(orders)
         if _removed:
             _log(f"Ignorerar {_removed} orderrad(er) pga Status = 35.")
     else:
         _log("OBS: Ingen order-statuskolumn hittad; kan inte filtrera Status = 35.")
 
-    # Normalisera buffert
-    buffer_df = buffer_raw.copy()
-    buffer_df["_artikel"] = buffer_df[buff_article_col].astype(str).str.strip()
-    buffer_df["_qty"] = buffer_df[buff_qty_col].map(to_num).astype(float)
-    buffer_df["_loc"] = buffer_df[buff_loc_col].astype(str).str.strip()
-    buffer_df["_received"] = smart_to_datetime(buffer_df[buff_dt_col]) if buff_dt_col and buff_dt_col in buffer_df.columns else pd.NaT
-    buffer_df["_source_id"] = buffer_df[buff_id_col].astype(str) if buff_id_col and buff_id_col in buffer_df.columns else "SRC-" + buffer_df.index.astype(str)
-
-    # Statusfilter (29/30/32)
-    if buff_status_col and buff_status_col in buffer_df.columns:
-        status_series = buffer_df[buff_status_col].astype(str).str.strip()
-        status_num = pd.to_numeric(status_series.str.extract(r"(-?\d+)")[0], errors="coerce")
-        allowed_str = {str(x) for x in ALLOC_BUFFER_STATUSES}
-        mask_allowed = status_series.isin(allowed_str) | status_num.isin(ALLOC_BUFFER_STATUSES)
-        removed = int((~mask_allowed).sum())
+    # Normalisera buffert – bara arbetskolumnerna
+    buffer_df = pd.DataFrame({
+        "_artikel": buffer_raw[buff_article_col].astype(str).str.strip(),
+        "_qty": to_num_series(buffer_raw[buff_qty_col]),
+        "_loc": buffer_raw[buff_loc_col].astype(str).str.strip(),
+        "_received": smart_to_datetime(buffer_raw[buff_dt_col]) if buff_dt_col and buff_dt_col in buffer_raw.columns else pd.NaT,
+        "_source_id": buffer_raw[buff_id_col].astype(str) if buff_id_col and buff_id_col in buffer_raw.columns else ("SRC-" + buffer_raw.index.astype(str)).to_numpy(),
+    }, index=buffer_raw.index)
+
+    # Status-, plats- och kvantitetsfilter som en enda mask (en kopia)
+    keep = pd.Series(True, index=buffer_df.index)
+    if buff_status_col and buff_status_col in buffer_raw.columns:
+        keep = _status_to_num(buffer_raw[buff_status_col]).isin(ALLOC_BUFFER_STATUSES)
+        removed = int((~keep).sum())
         if removed:
             _log(f"Filtrerar bort {removed} buffertpall(ar) pga Status ej i {sorted(ALLOC_BUFFER_STATUSES)}.")
-        buffer_df = buffer_df[mask_allowed].copy()
     else:
         _log("OBS: Hittade ingen statuskolumn; ingen statusfiltrering tillämpas.")
 
-    # Platsfilter
     loc_upper = buffer_df["_loc"].str.upper()
-    mask_exclude = loc_upper.str.startswith(INVALID_LOC_PREFIXES, na=False) | loc_upper.isin(INVALID_LOC_EXACT)
-    excluded_count = int(mask_exclude.sum())
+    mask_exclude = loc_upper.isin(INVALID_LOC_EXACT)
+    for plen in {len(p) for p in INVALID_LOC_PREFIXES}:  # ett hashat isin per prefixlängd
+        mask_exclude |= loc_upper.str[:plen].isin([p for p in INVALID_LOC_PREFIXES if len(p) == plen])
+    excluded_count = int((mask_exclude & keep).sum())
     if excluded_count:
         _log(f"Filtrerar bort {excluded_count} rad(er) från bufferten pga lagerplats-regler ({INVALID_LOC_PREFIXES}*, {', '.join(sorted(INVALID_LOC_EXACT))}).")
-    buffer_df = buffer_df[~mask_exclude].copy()
-
-    # Liten minnesopt
-    try: buffer_df["_artikel"] = buffer_df["_artikel"].astype("category")
-    except Exception: pass
+    buffer_df = buffer_df[keep & ~mask_exclude & (buffer_df["_qty"] > 0)].copy()
 
     buffer_df["_is_autostore"] = buffer_df["_loc"].str.contains("AUTOSTORE", case=False, na=False)
-    buffer_df = buffer_df[buffer_df["_qty"] > 0].copy()
+
+    # Artikelkoder (index i buffertens artikellista) från de redan normaliserade strängarna;
+    # -1 = artikeln saknas i bufferten
+    art_codes, arts = pd.factorize(buffer_df["_artikel"])
+    buffer_df["_art_code"] = art_codes
+    order_codes = arts.get_indexer(orders["_artikel"])
+
+    # Minnesopt: nyckel-/textkolumner som kategorier (kvantiteter förblir float64 – de skrivs till resultatet)
+    for c in ("_artikel", "_loc", "_source_id"):
+        try: buffer_df[c] = buffer_df[c].astype("category")
+        except Exception: pass
 
     far_future = pd.Timestamp("2262-04-11")
     buffer_df["_received_ord"] = buffer_df["_received"].fillna(far_future)
 
-    pallets = buffer_df[~buffer_df["_is_autostore"]].copy().sort_values(by=["_artikel", "_received_ord", "_source_id"])
-    bins = buffer_df[buffer_df["_is_autostore"]].copy().sort_values(by=["_artikel", "_received_ord", "_source_id"])
-
-    pallet_queues: Dict[str, Deque[dict]] = defaultdict(deque)
-    for _, r in pallets.iterrows():
-        pallet_queues[str(r["_artikel"]).strip()].append({"source_id": r["_source_id"], "qty": float(r["_qty"]), "loc": r["_loc"], "received": r["_received"]})
-
-    bin_queues: Dict[str, Deque[dict]] = defaultdict(deque)
-    for _, r in bins.iterrows():
-        bin_queues[str(r["_artikel"]).strip()].append({"source_id": r["_source_id"], "qty": float(r["_qty"]), "loc": r["_loc"], "received": r["_received"]})
-
-    allocated_rows: List[dict] = []
-    near_miss_rows: List[dict] = []
-
-    def clone_row(orow: pd.Series) -> dict:
-        return orow.to_dict()
-
-    def record_near_miss(orow: pd.Series, pal: dict, need: float) -> None:
-        if need <= 0: return
-        diff = pal["qty"] - need
-        if diff <= 0: return
-        pct = diff / need
-        if pct <= NEAR_MISS_PCT:
-            near_miss_rows.append({
-                "Artikel": str(orow["_artikel"]),
-                "OrderID": str(orow["_order_id"]),
-                "OrderRad": str(orow["_order_line"]),
-                "PallID": str(pal["source_id"]),
-                "Källplats": str(pal["loc"]),
-                "Mottagen": pal["received"],
-                "Behov_vid_tillfället": need,
-                "Pall_kvantitet": pal["qty"],
-                "Skillnad": diff,
-                "Procentuell skillnad (%)": pct * 100.0,
-                "Anledning": "Pallen var ≤15% större än återstående behov (kan ej brytas)"
-            })
-
-    for _, orow in orders.iterrows():
-        art = str(orow["_artikel"]).strip()
-        need = float(orow["_qty"])
-        if need <= 0: continue
-
-        # 1) HELPALL
-        pq = pallet_queues.get(art, deque())
-        new_pq = deque()
-        tmp = deque(pq)
-        any_helpall = False
-        while tmp and need > 0:
-            pal = tmp.popleft()
-            pal_qty = pal["qty"]
-            if pal_qty <= need:
-                sub = clone_row(orow)
-                sub[order_qty_col] = pal_qty
-                sub["Zon (beräknad)"] = "H"
-                sub["Källtyp"] = "HELPALL"
-                sub["Källa"] = pal["source_id"]
-                sub["Källplats"] = pal["loc"]
-                allocated_rows.append(sub)
-                need -= pal_qty
-                any_helpall = True
-            else:
-                record_near_miss(orow, pal, need)
-                new_pq.append(pal)
-        while tmp: new_pq.append(tmp.popleft())
-        pallet_queues[art] = new_pq
-
-        # 2) AUTOSTORE
-        any_autostore = False
-        bq = bin_queues.get(art, deque())
-        new_bq = deque()
-        while bq and need > 0:
-            binr = bq.popleft()
-            take = min(binr["qty"], need)
-            if take > 0:
-                sub = clone_row(orow)
-                sub[order_qty_col] = take
-                sub["Zon (beräknad)"] = "R"
-                sub["Källtyp"] = "AUTOSTORE"
-                sub["Källa"] = binr["source_id"]
-                sub["Källplats"] = binr["loc"]
-                allocated_rows.append(sub)
-                binr["qty"] -= take
-                need -= take
-                any_autostore = True
-            if binr["qty"] > 0: new_bq.append(binr)
-        while bq: new_bq.append(bq.popleft())
-        bin_queues[art] = new_bq
+    pallets = buffer_df[~buffer_df["_is_autostore"]].sort_values(by=["_art_code", "_received_ord", "_source_id"])
+    bins = buffer_df[buffer_df["_is_autostore"]].sort_values(by=["_art_code", "_received_ord", "_source_id"])
 
-        # 3) HUVUDPLOCK
-        any_mainpick = False
-        if need > 0:
-            sub = clone_row(orow)
-            sub[order_qty_col] = need
-            sub["Zon (beräknad)"] = "A"
-            sub["Källtyp"] = "HUVUDPLOCK"
-            sub["Källa"] = ""
-            sub["Källplats"] = ""
-            allocated_rows.append(sub)
-            any_mainpick = True
-            need = 0.0
-
-        # Near-miss markering
-        if not any_helpall and (any_autostore or any_mainpick):
-            for r in near_miss_rows:
-                if r["OrderID"] == str(orow["_order_id"]) and r["OrderRad"] == str(orow["_order_line"]):
-                    r["Gäller (INSTEAD R/A)"] = True
-        else:
-            for r in near_miss_rows:
-                if r["OrderID"] == str(orow["_order_id"]) and r["OrderRad"] == str(orow["_order_line"]):
-                    r["Gäller (INSTEAD R/A)"] = False
-
-    allocated_df = pd.DataFrame(allocated_rows)
-
-    # Om en artikel har AUTOSTORE-rad → gör alla dess icke-HELPALL till AUTOSTORE
-    try:
-        if not allocated_df.empty and ("Källtyp" in allocated_df.columns):
-            if "Zon (beräknad)" not in allocated_df.columns:
-                allocated_df["Zon (beräknad)"] = ""
-            low = {c.lower(): c for c in allocated_df.columns}
-            art_col_res = None
-            for n in ["artikel", "article", "artnr", "art.nr", "artikelnummer", "_artikel"]:
-                if n.lower() in low:
-                    art_col_res = low[n.lower()]; break
-            if art_col_res:
-                auto_arts = set(allocated_df.loc[allocated_df["Källtyp"].astype(str) == "AUTOSTORE", art_col_res].astype(str).str.strip())
-                if auto_arts:
-                    mask_same = allocated_df[art_col_res].astype(str).str.strip().isin(auto_arts)
-                    mask_change = mask_same & (allocated_df["Källtyp"].astype(str) != "HELPALL")
-                    allocated_df.loc[mask_change, "Källtyp"] = "AUTOSTORE"
-                    allocated_df.loc[mask_change, "Zon (beräknad)"] = "R"
-    except Exception:
-        pass
+    # SoA: parallella arrayer per källa + (start, slut) per artikelkod
+    def to_soa(src: pd.DataFrame):
+        codes = src["_art_code"].to_numpy()
+        keys = np.arange(len(arts))
+        return (src["_source_id"].to_numpy(dtype=object),
+                src["_qty"].to_numpy(dtype=float),
+                src["_loc"].to_numpy(dtype=object),
+                src["_received"].to_numpy(),
+                np.searchsorted(codes, keys, side="left"),
+                np.searchsorted(codes, keys, side="right"))
+
+    pal_src, pal_qty, pal_loc, pal_received, pal_head, pal_end = to_soa(pallets)
+    bin_src, bin_qty, bin_loc, _, bin_head, bin_end = to_soa(bins)
+
+    out_order, out_src, out_taken, out_kind, nm_order, nm_src, nm_need, instead = _drain(
+        order_codes, orders["_qty"].to_numpy(dtype=float),
+        pal_qty.copy(), pal_head, pal_end,
+        bin_qty.copy(), bin_head, bin_end,
+        float(NEAR_MISS_PCT),
+    )
+
+    # Materialisera resultatet en gång (kolumnvis) i stället för rad-för-rad
+    is_help = out_kind == KIND_HELPALL
+    is_bin = out_kind == KIND_AUTOSTORE
+    src_pos = np.where(out_src >= 0, out_src, 0)
+    kalla = np.full(len(out_kind), "", dtype=object)
+    kallplats = np.full(len(out_kind), "", dtype=object)
+    if len(pal_src):
+        kalla[is_help] = pal_src[src_pos[is_help]]
+        kallplats[is_help] = pal_loc[src_pos[is_help]]
+    if len(bin_src):
+        kalla[is_bin] = bin_src[src_pos[is_bin]]
+        kallplats[is_bin] = bin_loc[src_pos[is_bin]]
+    # Har en artikel någon AUTOSTORE-rad blir dess HUVUDPLOCK-rader också AUTOSTORE (Källa/Källplats förblir tomma).
+    # En bit per artikelkod; sista platsen är vakt för artiklar utanför bufferten (kod -1).
+    out_codes = order_codes[out_order]
+    has_autostore = np.zeros(len(arts) + 1, dtype=bool)
+    has_autostore[out_codes[is_bin]] = True
+    out_kind[(out_kind == KIND_HUVUDPLOCK) & has_autostore[out_codes]] = KIND_AUTOSTORE
+
+    allocated_df = orders_raw.iloc[orders["_row"].to_numpy()[out_order]].reset_index(drop=True)
+    allocated_df[order_qty_col] = out_taken
+    allocated_df["Zon (beräknad)"] = np.array(KIND_ZONES, dtype=object)[out_kind]
+    allocated_df["Källtyp"] = pd.Categorical.from_codes(out_kind, categories=KIND_CATEGORIES)
+    allocated_df["Källa"] = kalla
+    allocated_df["Källplats"] = kallplats
 
     added_cols = ["Zon (beräknad)", "Källtyp", "Källa", "Källplats"]
     ordered_cols = [c for c in orders_raw.columns] + [c for c in added_cols if c not in orders_raw.columns]
@@ -227,5 +267,22 @@ def allocate(orders_raw: pd.DataFrame, buffer_raw: pd.DataFrame, log=None) -> Tu
     else:
         allocated_df = pd.DataFrame(columns=ordered_cols)
 
-    near_miss_df = pd.DataFrame(near_miss_rows)
+    near_miss_df = pd.DataFrame()
+    if len(nm_order):
+        pal_full = pal_qty[nm_src]
+        diff = pal_full - nm_need
+        near_miss_df = pd.DataFrame({
+            "Artikel": orders["_artikel"].to_numpy()[nm_order],
+            "OrderID": orders["_order_id"].to_numpy()[nm_order],
+            "OrderRad": orders["_order_line"].to_numpy()[nm_order],
+            "PallID": pal_src[nm_src],
+            "Källplats": pal_loc[nm_src],
+            "Mottagen": pal_received[nm_src],
+            "Behov_vid_tillfället": nm_need,
+            "Pall_kvantitet": pal_full,
+            "Skillnad": diff,
+            "Procentuell skillnad (%)": diff / nm_need * 100.0,
+            "Anledning": "Pallen var ≤15% större än återstående behov (kan ej brytas)",
+            "Gäller (INSTEAD R/A)": instead[nm_order] == 1,
+        })
     return allocated_df, near_miss_df
@@ -1,35 +1,53 @@
 # logic/refill.py
 from __future__ import annotations
-from typing import Dict, List, Tuple
+from typing import Dict, Tuple
 import pandas as pd
 import numpy as np
 
 from ..config.constants import REFILL_BUFFER_STATUSES
 from ..io.schemas import ORDER_SCHEMA, BUFFER_SCHEMA, NOT_PUTAWAY_SCHEMA
 from ..io.file_readers import normalize_saldo, normalize_not_putaway
-from ..utils.common import find_col, smart_to_datetime, to_num
+from ..utils.common import find_col, smart_to_datetime, to_num_series, strip_text
 
 
+_ANNOTATE_COLS = ["ADV_90", "ABC_klass", "DagarSedanSenast", "UnikaPlockdagar_90", "NollraderPerPlockdag_90"]
+
+def index_metrics(df_metrics: pd.DataFrame) -> pd.DataFrame:
+    """Metrikens annoteringskolumner indexerade på Artikel – byggs en gång, delas av flera annotate_refill."""
+    cols = [c for c in _ANNOTATE_COLS if c in df_metrics.columns]
+    return df_metrics.set_index("Artikel")[cols]
+
 def annotate_refill(refill_df: pd.DataFrame, df_metrics: pd.DataFrame) -> pd.DataFrame:
-    if refill_df is None or refill_df.empty or df_metrics is None or df_metrics.empty:
+    if refill_df is None or refill_df.empty or df_metrics is None or len(df_metrics) == 0:
         return refill_df
-    cols = ["Artikel", "ADV_90", "ABC_klass", "DagarSedanSenast", "UnikaPlockdagar_90", "NollraderPerPlockdag_90"]
-    cols = [c for c in cols if c in df_metrics.columns or c == "Artikel"]
-    out = refill_df.merge(df_metrics[cols], on="Artikel", how="left")
-    return out
+    if df_metrics.index.name != "Artikel":
+        df_metrics = index_metrics(df_metrics)
+    if not df_metrics.index.is_unique:
+        return refill_df.merge(df_metrics.reset_index(), on="Artikel", how="left")
+    ann = df_metrics.reindex(refill_df["Artikel"].to_numpy())
+    out = refill_df.reset_index(drop=True)
+    return pd.concat([out, ann.reset_index(drop=True)], axis=1)
+
+def _fifo_pallet_count(fifo_cum: np.ndarray, need: float) -> int:
+    """Antal pallar (FIFO) som täcker need, givet ackumulerade pallantal; alla om de inte räcker.
+    Första träff i stället för searchsorted – negativa antal gör kumulativa summan icke-monoton."""
+    hit = np.flatnonzero(fifo_cum >= need)
+    return int(hit[0]) + 1 if hit.size else int(fifo_cum.size)
 
 def _reclassify_skrymmande(result_df: pd.DataFrame, saldo_norm: pd.DataFrame | None) -> pd.DataFrame:
     if result_df is None or result_df.empty or saldo_norm is None or saldo_norm.empty:
         return result_df
     res = result_df.copy()
     art_col = find_col(res, ORDER_SCHEMA["artikel"], required=True)
-    pp_map: Dict[str, str] = {}
-    for _, r in saldo_norm.iterrows():
-        a = str(r.get("Artikel", "")).strip()
-        p = str(r.get("Plockplats", "") or "").strip()
-        if a and p and a not in pp_map:
-            pp_map[a] = p
-    if not pp_map:
+    if "Artikel" not in saldo_norm.columns or "Plockplats" not in saldo_norm.columns:
+        return res
+    # Första icke-tomma plockplats per artikel som uppslagsserie
+    s_art = strip_text(saldo_norm["Artikel"])
+    s_pp = strip_text(saldo_norm["Plockplats"].fillna(""))
+    keep = s_art.ne("") & s_pp.ne("")
+    pp_map = pd.Series(s_pp[keep].to_numpy(), index=s_art[keep].to_numpy())
+    pp_map = pp_map[~pp_map.index.duplicated()]
+    if pp_map.empty:
         return res
     ktyp_series = res.get("Källtyp", pd.Series("", index=res.index)).astype(str)
     kalla_blank = res.get("Källa", pd.Series("", index=res.index))
@@ -39,10 +57,9 @@ def _reclassify_skrymmande(result_df: pd.DataFrame, saldo_norm: pd.DataFrame | N
     if not mask.any():
         return res
     arts = res.loc[mask, art_col].astype(str).str.strip()
-    pp = arts.map(lambda a: pp_map.get(a, ""))
-    pp_up = pp.str.upper()
-    cond = pp_up.str.startswith("SK") | pp_up.str.contains("BRAND", na=False)
-    idx = res.loc[mask].index[cond.fillna(False)]
+    pp_up = strip_text(arts.map(pp_map).fillna("")).str.upper()
+    cond = pp_up.str.startswith("SK") | pp_up.str.contains("BRAND", regex=False)
+    idx = res.loc[mask].index[cond.fillna(False).to_numpy(dtype=bool)]
     if len(idx) > 0:
         res.loc[idx, "Källtyp"] = "SKRYMMANDE"
         if "Zon (beräknad)" not in res.columns:
@@ -56,8 +73,8 @@ def calculate_refill(allocated_df: pd.DataFrame,
                      not_putaway_df: pd.DataFrame | None = None
                      ) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
-    result = allocated_df.copy()
-    buff = buffer_raw.copy()
+    result = allocated_df  # läses bara
+    buff = buffer_raw
 
     art_col_res = find_col(result, ORDER_SCHEMA["artikel"])
     qty_col_res = find_col(result, ORDER_SCHEMA["qty"])
@@ -68,33 +85,41 @@ def calculate_refill(allocated_df: pd.DataFrame,
     id_col_buf  = find_col(buff, BUFFER_SCHEMA["id"], required=False, default=None)
     status_col_buf = find_col(buff, BUFFER_SCHEMA["status"], required=False, default=None)
 
-    b = buff.copy()
-    b["_artikel"] = b[art_col_buf].astype(str).str.strip()
-    b["_qty"] = b[qty_col_buf].map(to_num).astype(float)
-    b["_received"] = smart_to_datetime(b[dt_col_buf]) if dt_col_buf and dt_col_buf in b.columns else pd.NaT
-    b["_source_id"] = b[id_col_buf].astype(str) if id_col_buf and id_col_buf in b.columns else "SRC-" + b.index.astype(str)
+    # Smal arbetsram med bara de kolumner refill använder; buffer_raw kopieras inte
+    b = pd.DataFrame({
+        "_artikel": strip_text(buff[art_col_buf]).astype("category"),  # sortering/gruppering på heltalskoder
+        "_qty": to_num_series(buff[qty_col_buf]),
+        "_received": buff[dt_col_buf] if dt_col_buf else pd.NaT,  # rådata; tolkas först för köade pallar
+        "_source_id": buff[id_col_buf].astype(str) if id_col_buf else "SRC-" + buff.index.astype(str),
+    }, index=buff.index)
 
-    if status_col_buf and status_col_buf in b.columns:
-        _s = b[status_col_buf].astype(str).str.strip()
+    if status_col_buf:
+        _s = buff[status_col_buf].astype(str).str.strip()
         _snum = pd.to_numeric(_s.str.extract(r"(-?\d+)")[0], errors="coerce")
         allowed_str = {str(x) for x in REFILL_BUFFER_STATUSES}
-        b = b[_s.isin(allowed_str) | _snum.isin(REFILL_BUFFER_STATUSES)].copy()
+        b = b[_s.isin(allowed_str) | _snum.isin(REFILL_BUFFER_STATUSES)]
 
-    used_help_ids: set[str] = set()
-    if "Källtyp" in result.columns and "Källa" in result.columns:
-        used_help_ids = set(result[result["Källtyp"].astype(str) == "HELPALL"]["Källa"].dropna().astype(str).tolist())
+    # Klassning av resultatraderna i ett svep: HELPALL-källor, HP/SKRYMMANDE och AUTOSTORE utan källa
+    ktyp = result["Källtyp"].astype(str) if "Källtyp" in result.columns else pd.Series("", index=result.index)
+    kalla = result["Källa"] if "Källa" in result.columns else None
+    k_blank = (kalla.isna() | (kalla.astype(str).str.strip() == "")) if kalla is not None else pd.Series(True, index=result.index)
+    m_hp = ktyp.isin(["HUVUDPLOCK", "SKRYMMANDE"])
+    m_as = (ktyp == "AUTOSTORE") & k_blank
+
+    used_help_ids: frozenset = frozenset()
+    if kalla is not None:
+        used_help_ids = frozenset(kalla[ktyp == "HELPALL"].dropna().astype(str).unique())
 
     saldo_sum: Dict[str, float] = {}
     plockplats_by_art: Dict[str, str] = {}
     if isinstance(saldo_df, pd.DataFrame) and not saldo_df.empty:
         try:
             s_norm = normalize_saldo(saldo_df)
-            for _, r in s_norm.iterrows():
-                art = str(r["Artikel"]).strip()
-                saldo_sum[art] = float(saldo_sum.get(art, 0.0) + float(r.get("Plocksaldo", 0.0)))
-                pp = str(r.get("Plockplats", "") or "").strip()
-                if pp and art not in plockplats_by_art:
-                    plockplats_by_art[art] = pp
+            s_art = s_norm["Artikel"].astype(str).str.strip()
+            saldo_sum = s_norm["Plocksaldo"].astype(float).groupby(s_art).sum().to_dict()
+            s_pp = s_norm["Plockplats"].fillna("").astype(str).str.strip()
+            has_pp = s_pp.ne("")
+            plockplats_by_art = s_pp[has_pp].groupby(s_art[has_pp]).first().to_dict()
         except Exception:
             saldo_sum = {}
             plockplats_by_art = {}
@@ -102,109 +127,95 @@ def calculate_refill(allocated_df: pd.DataFrame,
     npu_sum: Dict[str, float] = {}
     if isinstance(not_putaway_df, pd.DataFrame) and not not_putaway_df.empty:
         try:
-            npu = not_putaway_df.copy()
+            npu = not_putaway_df
             npu_art_col = find_col(npu, NOT_PUTAWAY_SCHEMA["artikel"])
             npu_qty_col = find_col(npu, NOT_PUTAWAY_SCHEMA["antal"])
-            grp = npu.groupby(npu[npu_art_col].astype(str).str.strip())[npu_qty_col] \
-                     .apply(lambda s: float(pd.to_numeric(s, errors="coerce").fillna(0).sum()))
+            grp = pd.to_numeric(npu[npu_qty_col], errors="coerce").fillna(0.0).astype(float) \
+                    .groupby(npu[npu_art_col].astype(str).str.strip()).sum()
             npu_sum = {str(k): float(v) for k, v in grp.to_dict().items()}
         except Exception:
             npu_sum = {}
 
-    def fifo_for_art(art_key: str) -> pd.DataFrame:
-        d = b[b["_artikel"] == art_key].copy()
-        if not d.empty and used_help_ids:
-            d = d[~d["_source_id"].astype(str).isin(used_help_ids)].copy()
-        return d.sort_values("_received")
-
-    hp_like = result[result.get("Källtyp", "").isin(["HUVUDPLOCK", "SKRYMMANDE"])].copy()
-    rows_hp: List[dict] = []
+    # FIFO-kö per artikel: en sortering av hela bufferten, sedan {artikel: ackumulerat antal i FIFO-ordning}
+    # Bara artiklar med HP- eller AUTOSTORE-behov får en kö, och bara deras datum tolkas
+    b_fifo = b[~b["_source_id"].isin(used_help_ids)] if used_help_ids else b  # _source_id är redan text
+    wanted = strip_text(result.loc[m_hp | m_as, art_col_res]).unique()
+    b_fifo = b_fifo[b_fifo["_artikel"].isin(wanted)]
+    if dt_col_buf:
+        b_fifo = b_fifo.assign(_received=smart_to_datetime(b_fifo["_received"]))
+    b_fifo = b_fifo.sort_values(["_artikel", "_received"], kind="mergesort")
+    fifo_map: Dict[str, np.ndarray] = {
+        art: np.cumsum(q.to_numpy(dtype=np.float64)) for art, q in b_fifo.groupby("_artikel", sort=False, observed=True)["_qty"]
+    }
+    no_pallets = np.empty(0, dtype=np.float64)
+
+    hp_like = result[m_hp].copy()
+    refill_hp_df = pd.DataFrame()
     if not hp_like.empty:
-        hp_like["_zon"] = np.where(hp_like["Källtyp"].astype(str) == "SKRYMMANDE", "S", "A")
+        hp_like["_zon"] = np.where(ktyp[m_hp] == "SKRYMMANDE", "S", "A")
         needs = (hp_like
-                 .assign(_art=hp_like[art_col_res].astype(str).str.strip(),
+                 .assign(_art=strip_text(hp_like[art_col_res]).astype("category"),
                          _qty=pd.to_numeric(hp_like[qty_col_res], errors="coerce").fillna(0.0))
-                 .groupby(["_art", "_zon"], as_index=False)["_qty"].sum())
-
-        for art_key, grp_art in needs.groupby("_art"):
-            total_need = float(grp_art["_qty"].sum())
-            if total_need <= 0: continue
-            adjusted_total = max(0.0, round(total_need) - float(saldo_sum.get(art_key, 0.0)))
-            if adjusted_total <= 0: continue
-
-            parts = []
-            allocated_sum = 0
-            for _, r in grp_art.iterrows():
-                zone = str(r["_zon"])
-                part = (float(r["_qty"]) / total_need) * adjusted_total if total_need > 0 else 0.0
-                val = int(round(part))
-                parts.append([zone, val]); allocated_sum += val
-            diff = int(adjusted_total) - int(allocated_sum)
-            if parts: parts[0][1] += diff
-
-            fifo_df = fifo_for_art(art_key)
-            tillgangligt = float(pd.to_numeric(fifo_df["_qty"], errors="coerce").sum()) if not fifo_df.empty else 0.0
-
-            for zone, behov_int in parts:
-                behov_int = int(max(0, behov_int))
-                if behov_int <= 0: continue
-                behov_kvar = float(behov_int); pall_count = 0
-                for q in (fifo_df["_qty"].astype(float) if not fifo_df.empty else []):
-                    if behov_kvar <= 0: break
-                    pall_count += 1; behov_kvar -= float(q)
-
-                rows_hp.append({
-                    "Artikel": art_key,
-                    "Zon": zone,
-                    "Behov (kolli)": behov_int,
-                    "FIFO-baserad beräkning": int(pall_count),
-                    "Tillräckligt tillgängligt saldo i buffert": "Ja" if tillgangligt >= behov_int else "Nej",
-                    "Plockplats": plockplats_by_art.get(art_key, ""),
-                    "Ej inlagrade (antal)": int(round(npu_sum.get(art_key, 0.0)))
-                })
-
-    refill_hp_df = pd.DataFrame(rows_hp)
-    if not refill_hp_df.empty:
-        refill_hp_df = refill_hp_df.sort_values(["Zon", "FIFO-baserad beräkning"], ascending=[True, False])
+                 .groupby(["_art", "_zon"], as_index=False, observed=True)["_qty"].sum())
+
+        # Behov per (artikel, zon): artikelns avrundade totalbehov minus plocksaldo fördelas
+        # proportionellt på zonerna; avrundningsresten läggs på artikelns första zon
+        # Summor per artikel via kategorikoderna (needs är sorterad på _art)
+        art_codes = needs["_art"].cat.codes.to_numpy()
+        art_keys = needs["_art"].cat.categories
+        qty = needs["_qty"].to_numpy(dtype=np.float64)
+        total = np.bincount(art_codes, weights=qty)[art_codes]
+        saldo = pd.Series(saldo_sum, dtype=np.float64).reindex(art_keys).fillna(0.0).to_numpy()[art_codes]
+        adjusted = np.maximum(0.0, np.round(total) - saldo)
+        ok = (total > 0) & (adjusted > 0)
+        # Kolli-talen ryms i int32; andelarna räknas i float64 så att avrundningen inte flyttar sig
+        vals = np.rint(np.divide(qty, total, out=np.zeros_like(qty), where=ok) * adjusted).astype(np.int32)
+        diff = adjusted.astype(np.int32) - np.bincount(art_codes, weights=vals).astype(np.int32)[art_codes]
+        first = np.r_[True, art_codes[1:] != art_codes[:-1]]
+        behov = np.maximum(0, vals + np.where(first, diff, 0))
+        keep = ok & (behov > 0)
+
+        if keep.any():
+            # Kolumnvis utdata; bara FIFO-räkningen går per rad (över cachade köer)
+            arts_hp = art_keys[art_codes[keep]].tolist()
+            need_hp = behov[keep].astype(np.int64)
+            cums = [fifo_map.get(a, no_pallets) for a in arts_hp]
+            avail = np.array([c[-1] if c.size else 0.0 for c in cums], dtype=np.float64)
+            refill_hp_df = pd.DataFrame({
+                "Artikel": arts_hp,
+                "Zon": needs["_zon"].to_numpy()[keep],
+                "Behov (kolli)": need_hp,
+                "FIFO-baserad beräkning": [_fifo_pallet_count(c, n) for c, n in zip(cums, need_hp.tolist())],
+                "Tillräckligt tillgängligt saldo i buffert": np.where(avail >= need_hp, "Ja", "Nej"),
+                "Plockplats": [plockplats_by_art.get(a, "") for a in arts_hp],
+                "Ej inlagrade (antal)": np.round([npu_sum.get(a, 0.0) for a in arts_hp]).astype(np.int64),
+            })
+            refill_hp_df = refill_hp_df.sort_values(["Zon", "FIFO-baserad beräkning"], ascending=[True, False])
 
     # --- AUTOSTORE (R) ---
     refill_autostore_df = pd.DataFrame()
     try:
-        as_df = result.copy()
+        as_df = result[m_as]
         if not as_df.empty:
-            mask_autostore = as_df["Källtyp"].astype(str) == "AUTOSTORE" if "Källtyp" in as_df.columns else pd.Series(False, index=as_df.index)
-            k_blank = as_df["Källa"].isna() | (as_df["Källa"].astype(str).str.strip() == "") if "Källa" in as_df.columns else pd.Series(True, index=as_df.index)
-            as_df = as_df[mask_autostore & k_blank].copy()
-        if not as_df.empty:
-            art_col_res_as = find_col(as_df, ORDER_SCHEMA["artikel"])
-            qty_col_res_as = find_col(as_df, ORDER_SCHEMA["qty"])
-            behov_per_art_as = as_df.groupby(as_df[art_col_res_as].astype(str).str.strip())[qty_col_res_as] \
-                                   .apply(lambda s: float(pd.to_numeric(s, errors="coerce").fillna(0).sum())) \
-                                   .to_dict()
-
-            rows_as: List[dict] = []
-            for art, behov in behov_per_art_as.items():
-                art_key = str(art).strip()
-                fifo_df = fifo_for_art(art_key)
-                tillgangligt = float(pd.to_numeric(fifo_df["_qty"], errors="coerce").sum()) if not fifo_df.empty else 0.0
-                behov_int = int(max(0, round(behov) - float(saldo_sum.get(art_key, 0.0))))
-                if behov_int <= 0: continue
-                remaining = float(behov_int); pall_count = 0
-                for q in (fifo_df["_qty"].astype(float) if not fifo_df.empty else []):
-                    if remaining <= 0: break
-                    pall_count += 1; remaining -= float(q)
-
-                rows_as.append({
-                    "Artikel": art_key,
-                    "Behov (kolli)": behov_int,
-                    "FIFO-baserad beräkning": int(pall_count),
-                    "Tillräckligt tillgängligt saldo i buffert": "Ja" if tillgangligt >= behov_int else "Nej",
-                    "Plockplats": plockplats_by_art.get(art_key, ""),
-                    "Ej inlagrade (antal)": int(round(npu_sum.get(art_key, 0.0)))
+            # Behov per artikel minus plocksaldo, avrundat och trunkerat som int(max(0, round(behov) - saldo))
+            behov_as = pd.to_numeric(as_df[qty_col_res], errors="coerce").fillna(0.0) \
+                          .groupby(strip_text(as_df[art_col_res])).sum()
+            saldo_as = pd.Series(saldo_sum, dtype=np.float64).reindex(behov_as.index).fillna(0.0).to_numpy()
+            behov_int = np.trunc(np.maximum(0.0, np.round(behov_as.to_numpy(dtype=np.float64)) - saldo_as)).astype(np.int64)
+            keep = behov_int > 0
+            if keep.any():
+                arts_as = behov_as.index[keep].tolist()
+                need_as = behov_int[keep]
+                cums = [fifo_map.get(a, no_pallets) for a in arts_as]
+                avail = np.array([c[-1] if c.size else 0.0 for c in cums], dtype=np.float64)
+                refill_autostore_df = pd.DataFrame({
+                    "Artikel": arts_as,
+                    "Behov (kolli)": need_as,
+                    "FIFO-baserad beräkning": [_fifo_pallet_count(c, n) for c, n in zip(cums, need_as.tolist())],
+                    "Tillräckligt tillgängligt saldo i buffert": np.where(avail >= need_as, "Ja", "Nej"),
+                    "Plockplats": [plockplats_by_art.get(a, "") for a in arts_as],
+                    "Ej inlagrade (antal)": np.round([npu_sum.get(a, 0.0) for a in arts_as]).astype(np.int64),
                 })
-
-            refill_autostore_df = pd.DataFrame(rows_as)
-            if not refill_autostore_df.empty:
                 refill_autostore_df = refill_autostore_df.sort_values("FIFO-baserad beräkning", ascending=False)
     except Exception:
         refill_autostore_df = pd.DataFrame()
@@ -4,6 +4,12 @@ import pandas as pd
 import numpy as np
 from typing import Dict, Optional
 from ..io.excel_export import open_sales_excel
+from ..utils.common import ColumnResolver, strip_text
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow är valfritt – dagsaggregeringen körs då i pandas
+    pa = None
 
 
 # ---------------------------
@@ -16,149 +22,170 @@ def _to_date(s: pd.Series) -> pd.Series:
 def _to_num(s: pd.Series) -> pd.Series:
     return pd.to_numeric(s, errors="coerce")
 
-def _first_nonempty(s: pd.Series) -> str:
-    for x in s:
-        if isinstance(x, str) and x.strip():
-            return x.strip()
-    return ""
-
-def _detect_col(df: pd.DataFrame, candidates) -> Optional[str]:
-    """Sök kolumn via exakta namn (case-insensitivt) och därefter 'contains'."""
-    if df is None or df.empty:
-        return None
-    # exakta (case-insensitiv)
-    lowmap = {c.lower(): c for c in df.columns}
-    for cand in candidates:
-        if cand.lower() in lowmap:
-            return lowmap[cand.lower()]
-    # contains
-    lcands = [c.lower() for c in candidates]
-    for col in df.columns:
-        low = col.lower()
-        if any(c in low for c in lcands):
-            return col
-    return None
+def _upper_text(s: pd.Series) -> pd.Series:
+    """astype(str) → strip → upper (Arrow-kärnor om pyarrow finns, se strip_text)."""
+    return strip_text(s).str.upper()
+
+# Första bokstav i plats → zon (Å/Ä → A, Ö → O); övriga tecken ger NaN
+_ZONE_LETTER = {chr(c): chr(c) for c in range(ord("A"), ord("Z") + 1)}
+_ZONE_LETTER.update({"Å": "A", "Ä": "A", "Ö": "O"})
 
 def _prep_plocklogg(df_norm: pd.DataFrame) -> pd.DataFrame:
-    """Förväntar: Artikelnummer, datum, plockat. Hämtar/deriverar Zon om möjligt."""
+    """Förväntar: Artikelnummer, datum, plockat. Hämtar/deriverar Zon om möjligt.
+
+    Returnerar en smal ram (Artikelnummer, DatumNorm, Plockat, Zon) – df_norm kopieras inte.
+    """
     if df_norm is None or df_norm.empty:
         raise ValueError("Plocklogg är tom.")
-    df = df_norm.copy()
 
     # Artikelnr
-    if "Artikelnummer" not in df.columns:
+    if "Artikelnummer" not in df_norm.columns:
         raise ValueError("Plocklogg saknar kolumn 'Artikelnummer' efter normalisering.")
-    df["Artikelnummer"] = df["Artikelnummer"].astype(str).str.strip()
+    art = strip_text(df_norm["Artikelnummer"]).astype("category")
+    cols = ColumnResolver(df_norm)
 
     # Datum
-    dt_col = _detect_col(df, ["Datum", "Datum/tid", "Date", "Tidpunkt"])
+    dt_col = cols.resolve(["Datum", "Datum/tid", "Date", "Tidpunkt"], required=False)
     if not dt_col:
         raise ValueError("Plocklogg saknar datumkolumn (t.ex. 'Datum').")
-    df["DatumNorm"] = _to_date(df[dt_col])
+    datum = _to_date(df_norm[dt_col])
 
     # Plockat (antal)
-    qty_col = _detect_col(df, ["Plockat", "Antal", "Quantity", "Qty"])
+    qty_col = cols.resolve(["Plockat", "Antal", "Quantity", "Qty"], required=False)
     if not qty_col:
         raise ValueError("Plocklogg saknar kolumn för antal (t.ex. 'Plockat'/'Antal').")
-    df["Plockat"] = _to_num(df[qty_col]).fillna(0.0)
+    plockat = _to_num(df_norm[qty_col]).fillna(0.0)
 
     # --- ZON ---
     # 1) Direkt zon-kolumn
-    zon_col = _detect_col(df, [
+    zon_col = cols.resolve([
         "Zon", "Lagerzon", "Zon (beräknad)", "Zon (Beräknad)",
         "Plockzon", "PickZone", "Zone"
-    ])
+    ], required=False)
+    place_col = None
     if zon_col:
-        z = df[zon_col].astype(str).str.strip().str.upper()
-        df["Zon"] = z.str[0]  # första bokstaven räcker (E, H, ...)
+        z = _upper_text(df_norm[zon_col])
+        zon = z.str[0]  # första bokstaven räcker (E, H, ...)
+        if zon.dtype != object:  # Arrow-sträng → object med NaN som övriga kolumner
+            zon = zon.astype(object).where(zon.notna(), np.nan)
     else:
         # 2) Försök härleda från plats-kolumn (plockplats/lagerplats/…)
-        place_col = _detect_col(df, [
+        place_col = cols.resolve([
             "Plockplats", "Lagerplats", "Plats", "Location", "Lagerlokation",
             "PickLocation", "LagPlats", "Lokation", "Loc"
-        ])
+        ], required=False)
         if place_col:
-            place = df[place_col].astype(str).str.strip().str.upper()
-            # Ta första bokstav a–z om den finns, annars NaN
+            place = _upper_text(df_norm[place_col])
+            # Första tecknet via uppslagstabell: A–Z (Å/Ä→A, Ö→O), annars NaN
             # (t.ex. 'E12-03' → 'E')
-            z_guess = place.str.extract(r'^\s*([A-ZÅÄÖ])', expand=False)
-            df["Zon"] = z_guess.str.replace("Å","A").str.replace("Ä","A").str.replace("Ö","O")
+            zon = place.str[0].map(_ZONE_LETTER)
         else:
-            df["Zon"] = pd.NA
+            zon = pd.NA
+
+    df = pd.DataFrame({"Artikelnummer": art, "DatumNorm": datum, "Plockat": plockat, "Zon": zon},
+                      index=df_norm.index)
 
     # Rensa rader utan giltigt datum
-    df = df[~df["DatumNorm"].isna()].copy()
+    df = df[df["DatumNorm"].notna()]
+    # Utan zon- och platskolumn är Zon helt tom – nedströms hoppar då över zonstegen
+    df.attrs["has_zon"] = bool(zon_col or place_col)
     return df
 
 def _build_daily(df: pd.DataFrame, mask: Optional[pd.Series] = None) -> pd.DataFrame:
     """Aggregerar till per-dag per artikel (summa plockat)."""
-    sub = df[mask].copy() if mask is not None else df.copy()
+    sub = df[mask] if mask is not None else df
     if sub.empty:
         return pd.DataFrame(columns=["Artikelnummer", "DatumNorm", "DagSum"])
-    grp = (sub.groupby(["Artikelnummer", "DatumNorm"], as_index=False)["Plockat"]
+    if pa is not None:
+        # Arrows hash-aggregering; ordningen är första förekomst (_days_and_avg sorterar själv)
+        t = pa.Table.from_pandas(sub[["Artikelnummer", "DatumNorm", "Plockat"]], preserve_index=False)
+        grp = (t.group_by(["Artikelnummer", "DatumNorm"])
+                .aggregate([("Plockat", "sum")])
+                .to_pandas()
+                .rename(columns={"Plockat_sum": "DagSum"}))
+        return grp[["Artikelnummer", "DatumNorm", "DagSum"]]
+    grp = (sub.groupby(["Artikelnummer", "DatumNorm"], as_index=False, observed=True)["Plockat"]
                .sum()
                .rename(columns={"Plockat": "DagSum"}))
     return grp
 
 def _days_and_avg(daily_df: pd.DataFrame) -> pd.DataFrame:
-    """Räknar antal dagar (med DagSum>0) och snitt per plockdag."""
+    """Räknar antal dagar (med DagSum>0) och snitt per plockdag i ett sorterat pass."""
     if daily_df.empty:
         return pd.DataFrame(columns=["Artikelnummer", "Dagar", "SnittPerDag"])
-    d = daily_df[daily_df["DagSum"] > 0].copy()
+    d = daily_df[daily_df["DagSum"] > 0]
     if d.empty:
         return pd.DataFrame(columns=["Artikelnummer", "Dagar", "SnittPerDag"])
-    days = d.groupby("Artikelnummer")["DatumNorm"].nunique().rename("Dagar")
-    avg  = d.groupby("Artikelnummer")["DagSum"].mean().rename("SnittPerDag")
-    out = pd.concat([days, avg], axis=1).reset_index()
-    return out
+    # daily_df är redan summerad per (artikel, dag) → varje rad är en unik plockdag
+    codes, uniq = pd.factorize(d["Artikelnummer"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    dag = d["DagSum"].to_numpy(dtype=float)[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    days = np.diff(np.r_[starts, len(order)])
+    sums = np.add.reduceat(dag, starts)
+    return pd.DataFrame({"Artikelnummer": np.asarray(uniq), "Dagar": days, "SnittPerDag": sums / days})
+
+def _zone_sets(df: pd.DataFrame) -> pd.DataFrame:
+    """ZonSet per artikel (sorterade unika zonbokstäver, t.ex. 'EH') via en bitmask per artikel."""
+    z = df["Zon"]
+    sub = df[z.notna() & (z != "")]
+    if sub.empty:
+        return pd.DataFrame({"Artikelnummer": [], "ZonSet": []})
+    art_codes, arts = pd.factorize(sub["Artikelnummer"])
+    zon_codes, letters = pd.factorize(sub["Zon"].astype(str).str[:1], sort=True)
+    # int64 räcker för ≤63 olika bokstäver, annars Python-heltal (object)
+    dtype = np.int64 if len(letters) < 64 else object
+    bits = np.left_shift(np.ones(len(zon_codes), dtype=dtype), zon_codes.astype(dtype))
+    order = np.argsort(art_codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(art_codes[order]) != 0])
+    masks = np.bitwise_or.reduceat(bits[order], starts)
+    # Avkoda bara de distinkta maskerna till strängar
+    uniq, inv = np.unique(masks, return_inverse=True)
+    decoded = np.array(["".join(l for i, l in enumerate(letters) if (int(m) >> i) & 1) for m in uniq], dtype=object)
+    return pd.DataFrame({"Artikelnummer": np.asarray(arts)[art_codes[order][starts]], "ZonSet": decoded[inv]})
 
 def _prep_saldo(saldo_norm: Optional[pd.DataFrame]) -> pd.DataFrame:
     """Saldo för plockplats per artikel."""
     if saldo_norm is None or saldo_norm.empty:
         return pd.DataFrame(columns=["Artikelnummer", "Plockplats"])
-    s = saldo_norm.copy()
-    if "Artikelnummer" not in s.columns and "Artikel" in s.columns:
-        s = s.rename(columns={"Artikel": "Artikelnummer"})
-    s["Artikelnummer"] = s["Artikelnummer"].astype(str).str.strip()
-    if "Plockplats" in s.columns:
-        s["Plockplats"] = s["Plockplats"].astype(str).fillna("").str.strip()
-    else:
-        s["Plockplats"] = ""
-    agg = (s.groupby("Artikelnummer", as_index=False)
-             .agg({"Plockplats": _first_nonempty}))
-    return agg
+    art_col = "Artikel" if "Artikelnummer" not in saldo_norm.columns and "Artikel" in saldo_norm.columns else "Artikelnummer"
+    s = pd.DataFrame({
+        "Artikelnummer": strip_text(saldo_norm[art_col]),
+        "Plockplats": strip_text(saldo_norm["Plockplats"]) if "Plockplats" in saldo_norm.columns else "",
+    })
+    # Första icke-tomma plats per artikel; artiklar utan plats får ""
+    first = (s[s["Plockplats"] != ""]
+               .drop_duplicates("Artikelnummer", keep="first")
+               .set_index("Artikelnummer")["Plockplats"])
+    arts = pd.Index(s["Artikelnummer"].unique(), name="Artikelnummer").sort_values()
+    agg = first.reindex(arts, fill_value="").reset_index()
+    return agg.astype(object)  # liten ram; samma objektkolumner som övriga delar av underlaget
 
 def _prep_buffer(buffer_df: Optional[pd.DataFrame]) -> pd.DataFrame:
     """Medel 'Antal per pall' per artikel från buffertpallar, ta bort extremt små outliers (<50% av median)."""
     if buffer_df is None or buffer_df.empty:
         return pd.DataFrame(columns=["Artikelnummer", "Antal per pall"])
 
-    b = buffer_df.copy()
-    art_col = _detect_col(b, ["Artikelnummer", "Artikel", "Art.nr", "Artikelnr"])
-    qty_col = _detect_col(b, ["Antal", "Quantity", "Qty", "Kolli"])
+    cols = ColumnResolver(buffer_df)  # ett gemener-index för båda uppslagen
+    art_col = cols.resolve(["Artikelnummer", "Artikel", "Art.nr", "Artikelnr"], required=False)
+    qty_col = cols.resolve(["Antal", "Quantity", "Qty", "Kolli"], required=False)
     if not art_col or not qty_col:
         return pd.DataFrame(columns=["Artikelnummer", "Antal per pall"])
 
-    b["Artikelnummer"] = b[art_col].astype(str).str.strip()
-    b["AntalRaw"] = _to_num(b[qty_col])
-
-    def _robust_mean(vals: pd.Series) -> float:
-        vals = vals.dropna()
-        vals = vals[vals > 0]
-        if len(vals) == 0:
-            return np.nan
-        med = float(vals.median())
-        if med <= 0:
-            return float(vals.mean())
-        filt = vals[vals >= 0.5 * med]  # ta bort extremt små outliers
-        if len(filt) == 0:
-            filt = vals
-        return float(filt.mean())
-
-    agg = (b.groupby("Artikelnummer")["AntalRaw"]
-             .apply(_robust_mean)
-             .rename("Antal per pall")
-             .reset_index())
+    b = pd.DataFrame({
+        "Artikelnummer": buffer_df[art_col].astype(str).str.strip(),
+        "AntalRaw": _to_num(buffer_df[qty_col]),
+    })
+
+    # Medianen av positiva värden är alltid ≥ 0.5*median själv → filtret tömmer aldrig en grupp
+    pos = b[b["AntalRaw"] > 0]
+    med = pos.groupby("Artikelnummer")["AntalRaw"].transform("median")
+    kept = pos[pos["AntalRaw"] >= 0.5 * med]  # ta bort extremt små outliers
+    arts = pd.Index(b["Artikelnummer"].unique(), name="Artikelnummer").sort_values()
+    agg = (kept.groupby("Artikelnummer")["AntalRaw"].mean()
+               .reindex(arts)
+               .rename("Antal per pall")
+               .reset_index())
     return agg
 
 
@@ -182,19 +209,17 @@ def compute_sales_metrics(
                  "SnittPerDag": "Snitt beställt per plockdag"}
     )
 
+    has_zon = df.attrs.get("has_zon", True) and "Zon" in df.columns
+
     # Zon-set per artikel
     # (Filtrera bort NaN/okända zoner så de inte stör 'Endast E' / 'E & H')
-    if "Zon" in df.columns:
-        zmap = (df.dropna(subset=["Zon"])
-                  .groupby("Artikelnummer")["Zon"]
-                  .apply(lambda s: "".join(sorted(set([str(x)[:1] for x in s if isinstance(x, str) and x]))))
-                  .rename("ZonSet")
-                  .reset_index())
+    if has_zon:
+        zmap = _zone_sets(df)
     else:
         zmap = pd.DataFrame({"Artikelnummer": [], "ZonSet": []})
 
     # Endast E (E-dagar och E-snitt)
-    if "Zon" in df.columns and df["Zon"].notna().any():
+    if has_zon and df["Zon"].notna().any():
         daily_e = _build_daily(df, mask=(df["Zon"] == "E"))
         e_stats = _days_and_avg(daily_e).rename(
             columns={"Dagar": "Antal dagar i plock (Endast E-zon)",
@@ -205,17 +230,14 @@ def compute_sales_metrics(
                                         "Antal dagar i plock (Endast E-zon)",
                                         "Snitt beställt per plockdag (Endast E-zon)"])
 
-    # Bas
-    base = any_stats.merge(zmap, on="Artikelnummer", how="left") \
-                    .merge(e_stats, on="Artikelnummer", how="left")
-
-    # Plockplats från saldo
+    # Plockplats från saldo, antal per pall från buffert
     saldo_m = _prep_saldo(saldo_norm)
-    base = base.merge(saldo_m, on="Artikelnummer", how="left")
-
-    # Antal per pall från buffert
     buff_m = _prep_buffer(buffer_df)
-    base = base.merge(buff_m, on="Artikelnummer", how="left")
+
+    # Bas: alla delramar är unika per artikel → en indexjoin i stället för fyra merge
+    base = (any_stats.set_index("Artikelnummer")
+                     .join([f.set_index("Artikelnummer") for f in (zmap, e_stats, saldo_m, buff_m)], how="left")
+                     .reset_index())
 
     # Typer/format
     for col in ["Antal dagar i plock",
@@ -243,6 +265,7 @@ def compute_sales_metrics(
                "ZonSet"]
     cols = [c for c in ordered if c in base.columns] + [c for c in base.columns if c not in ordered]
     base = base[cols]
+    base.attrs["has_zon"] = has_zon
 
     return base
 
@@ -252,10 +275,10 @@ def open_sales_insights(metrics: pd.DataFrame) -> str:
     if metrics is None or metrics.empty:
         raise RuntimeError("Inga data att visa.")
 
-    df = metrics.copy()
+    df = metrics  # läses bara; flikarna byggs som egna ramar
 
     # -------- Flik 1: Rekomenderade buffertuppdateringar --------
-    mask_1 = df.get("Plockplats", pd.Series([""]*len(df))).astype(str).str.endswith("1")
+    mask_1 = df.get("Plockplats", pd.Series("", index=df.index)).astype(str).str.endswith("1")
     rec = (df[mask_1]
              .loc[:, ["Artikelnummer",
                       "Plockplats",
@@ -267,25 +290,29 @@ def open_sales_insights(metrics: pd.DataFrame) -> str:
              .reset_index(drop=True))
 
     # -------- Flik 2: Endast EH i Plock --------
-    # ZonSet = t.ex. "E", "EH", "HE", "H", "AR" ...
-    zonset = df.get("ZonSet")
-    if zonset is not None:
-        only_e  = zonset.fillna("").str.fullmatch(r"E", na=False)
-        only_eh = zonset.fillna("").str.fullmatch(r"EH|HE", na=False)
-        ehe = pd.concat([
-            df[only_e ].assign(Kategori="Endast E"),
-            df[only_eh].assign(Kategori="Endast E & H"),
-        ], ignore_index=True)
-    else:
-        ehe = df.iloc[0:0].copy()
-        ehe["Kategori"] = pd.Series(dtype=object)
-
     ehe_cols = ["Artikelnummer",
                 "Plockplats",
                 "Antal dagar i plock (Endast E-zon)",
                 "Snitt beställt per plockdag (Endast E-zon)",
                 "Antal per pall",
                 "Kategori"]
+    # ZonSet = t.ex. "E", "EH", "H", "AR" ... (bokstäverna sorterade, så aldrig "HE")
+    zonset = df.get("ZonSet") if df.attrs.get("has_zon", True) else None
+    if zonset is not None:
+        zs = zonset.fillna("")
+        only_e  = zs.eq("E").to_numpy(dtype=bool)
+        only_eh = zs.eq("EH").to_numpy(dtype=bool)
+        # En enda gather: först 'Endast E', sedan 'Endast E & H' (samma radordning som förut)
+        rows = np.r_[np.flatnonzero(only_e), np.flatnonzero(only_eh)]
+        keep = [c for c in ehe_cols if c in df.columns]
+        ehe = df.iloc[rows, df.columns.get_indexer(keep)].reset_index(drop=True)
+        ehe["Kategori"] = pd.Categorical.from_codes(
+            np.repeat(np.array([0, 1], dtype=np.int8), [only_e.sum(), only_eh.sum()]),
+            categories=["Endast E", "Endast E & H"])
+    else:
+        ehe = df.iloc[0:0].copy()
+        ehe["Kategori"] = pd.Series(dtype=object)
+
     for c in ehe_cols:
         if c not in ehe.columns:
             ehe[c] = pd.NA
@@ -3,8 +3,12 @@ from .common import (
     _clean_columns,
     smart_to_datetime,
     to_num,
+    to_num_series,
+    strip_text,
     find_col,
+    ColumnResolver,
     logprintln,
+    logflush,
     _first_path_from_dnd,
 )
 
@@ -13,7 +17,11 @@ __all__ = [
     "_clean_columns",
     "smart_to_datetime",
     "to_num",
+    "to_num_series",
+    "strip_text",
     "find_col",
+    "ColumnResolver",
     "logprintln",
+    "logflush",
     "_first_path_from_dnd",
 ]
@@ -1,22 +1,41 @@
 # utils/common.py
 from __future__ import annotations
-import os, sys, re, subprocess, tempfile
+import os, sys, re, subprocess, tempfile, functools
 import pandas as pd
 import numpy as np
 import tkinter as tk
 from typing import List
 from io import StringIO  # not used but handy
 
+try:
+    import pyarrow  # noqa: F401
+    _ARROW_STR = "string[pyarrow]"
+except ImportError:  # pyarrow är valfritt – strängstegen körs då på objektkolumner
+    _ARROW_STR = None
+
+# Förkompilerade mönster (återanvänds av datum- och taltolkningen)
+_RE_YYYYMMDD = re.compile(r"^\d{8}$")
+_RE_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_RE_NUM = re.compile(r"([-+]?\d*\.?\d+)")
+
+# format="ISO8601" finns från pandas 2.0
+_PANDAS_ISO8601 = int(pd.__version__.split(".")[0]) >= 2
+
+@functools.lru_cache(maxsize=1)
+def _excel_engine() -> str | None:
+    """Tillgänglig Excel-skrivare; slås upp en gång per process."""
+    import importlib.util
+    if importlib.util.find_spec("openpyxl"):
+        return "openpyxl"
+    if importlib.util.find_spec("xlsxwriter"):
+        return "xlsxwriter"
+    return None
+
 def _open_df_in_excel(df, label: str = "data") -> str:
     """Skriv DF (eller {blad: DF}) till temporär fil och öppna i OS:et."""
-    import importlib
     if isinstance(df, dict):
-        engine = None
-        if importlib.util.find_spec("openpyxl"):
-            engine = "openpyxl"
-        elif importlib.util.find_spec("xlsxwriter"):
-            engine = "xlsxwriter"
-        else:
+        engine = _excel_engine()
+        if engine is None:
             raise RuntimeError("Saknar Excel-skrivare (installera 'openpyxl' eller 'xlsxwriter').")
         tmp = tempfile.NamedTemporaryFile(delete=False, suffix=f"_{label}.xlsx")
         path = tmp.name; tmp.close()
@@ -49,17 +68,23 @@ def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
 def smart_to_datetime(s) -> pd.Series:
     """Robust datumtolkning (ISO→dayfirst=False, annars True; fallback tvärtom)."""
     try:
-        ser = pd.Series(s) if not isinstance(s, pd.Series) else s
-        vals = ser.dropna().astype(str).str.strip()
-        sample = vals.head(50)
-        numeric_like = (sample.str.match(r"^\d{8}$").sum() >= max(1, int(len(sample) * 0.6)))
+        ser = s if isinstance(s, pd.Series) else pd.Series(s)
+        if pd.api.types.is_datetime64_any_dtype(ser):
+            return ser
+        # Formatet sniffas på 50 rader – strängar skapas bara för dem
+        sample = ser.dropna().head(50).astype("string").str.strip()
+        numeric_like = (sample.str.match(_RE_YYYYMMDD).sum() >= max(1, int(len(sample) * 0.6)))
         if numeric_like:
             dt = pd.to_datetime(ser, format="%Y%m%d", errors="coerce")
             if not dt.isna().all():
                 return dt
-        iso_like = (sample.str.match(r"^\d{4}-\d{2}-\d{2}").sum() >= max(1, int(len(sample) * 0.6)))
+        iso_like = (sample.str.match(_RE_ISO_DATE).sum() >= max(1, int(len(sample) * 0.6)))
         primary_dayfirst = False if iso_like else True
-        dt = pd.to_datetime(ser, errors="coerce", dayfirst=primary_dayfirst)
+        if iso_like and _PANDAS_ISO8601:
+            # ISO-parsern i C; klarar även blandning av datum och datum+tid i samma kolumn
+            dt = pd.to_datetime(ser, format="ISO8601", errors="coerce")
+        else:
+            dt = pd.to_datetime(ser, errors="coerce", dayfirst=primary_dayfirst)
         if hasattr(dt, "isna") and getattr(dt, "isna")().all():
             dt = pd.to_datetime(ser, errors="coerce", dayfirst=not primary_dayfirst)
         return dt
@@ -67,30 +92,72 @@ def smart_to_datetime(s) -> pd.Series:
         try: return pd.to_datetime(s, errors="coerce", dayfirst=True)
         except Exception: return pd.to_datetime(s, errors="coerce", dayfirst=False)
 
+def strip_text(s: pd.Series) -> pd.Series:
+    """astype(str) → strip. Med pyarrow körs strängstegen (och efterföljande str.*) i Arrow-kärnor."""
+    s = s.astype(str)
+    if _ARROW_STR:
+        s = s.astype(_ARROW_STR)
+    return s.str.strip()
+
 def to_num(x) -> float:
-    import pandas as pd, re
     if pd.isna(x): return 0.0
     s = str(x).replace(" ", "").replace(",", ".")
-    m = re.search(r"[-+]?\d*\.?\d+", s)
+    m = _RE_NUM.search(s)
     return float(m.group()) if m else 0.0
 
+def to_num_series(s: pd.Series) -> pd.Series:
+    """Vektoriserad to_num: samma tolkning (mellanslag bort, komma→punkt, första talet), saknas → 0.0."""
+    txt = s.astype(str).str.replace(" ", "", regex=False).str.replace(",", ".", regex=False)
+    num = pd.to_numeric(txt.str.extract(_RE_NUM, expand=False), errors="coerce")
+    return num.where(s.notna(), 0.0).fillna(0.0).astype(float)
+
+@functools.lru_cache(maxsize=64)
+def _lower_index(cols: tuple) -> dict:
+    """{gemener: originalnamn} per kolumnuppsättning; samma rubriker återanvänder uppslaget."""
+    return {c.lower(): c for c in cols}
+
+class ColumnResolver:
+    """Kolumnuppslag via schema-kandidater; gemener-index byggs en gång per kolumnuppsättning."""
+
+    def __init__(self, df: pd.DataFrame):
+        self._cols = list(df.columns)
+        self._lower = _lower_index(tuple(self._cols))
+
+    def resolve(self, candidates: List[str], required: bool = True, default=None) -> str:
+        cands = [c.lower() for c in candidates]
+        for cand in cands:
+            if cand in self._lower: return self._lower[cand]
+        for key, orig in self._lower.items():
+            for cand in cands:
+                if cand in key: return orig
+        if required and default is None:
+            raise KeyError(f"Hittar inte kolumnerna {candidates} i {self._cols}")
+        return default
+
 def find_col(df: pd.DataFrame, candidates: List[str], required: bool = True, default=None) -> str:
-    cols = {c.lower(): c for c in df.columns}
-    for cand in candidates:
-        if cand.lower() in cols: return cols[cand.lower()]
-    for key, orig in cols.items():
-        for cand in candidates:
-            if cand.lower() in key: return orig
-    if required and default is None:
-        raise KeyError(f"Hittar inte kolumnerna {candidates} i {list(df.columns)}")
-    return default
+    return ColumnResolver(df).resolve(candidates, required=required, default=default)
 
 def logprintln(txt_widget: tk.Text, msg: str) -> None:
+    """Köar en loggrad; kön skrivs i ett svep när Tk är ledigt (se logflush)."""
+    buf = getattr(txt_widget, "_log_buf", None)
+    if buf is None:
+        buf = txt_widget._log_buf = []
+    buf.append(msg)
+    if len(buf) == 1:
+        txt_widget.after_idle(logflush, txt_widget)
+
+def logflush(txt_widget: tk.Text) -> None:
+    """Skriver alla köade loggrader med en insert och en omritning."""
+    buf = getattr(txt_widget, "_log_buf", None)
+    if not buf:
+        return
+    text = "\n".join(buf) + "\n"
+    buf.clear()
     txt_widget.configure(state="normal")
-    txt_widget.insert("end", msg + "\n")
+    txt_widget.insert("end", text)
     txt_widget.see("end")
     txt_widget.configure(state="disabled")
-    txt_widget.update()
+    txt_widget.update_idletasks()
 
 def _first_path_from_dnd(event_data: str) -> str:
     raw = str(event_data).strip()
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from allokera.io import file_readers
+from allokera.io import read_pick_log
+
+
+def _write_pick_log_xlsx(path):
+    cols = {f"Kol{i}": [f"x{i}", f"y{i}", f"z{i}"] for i in range(16)}
+    cols["Kol3"] = ["5", "2,5", "1"]                                  # antal
+    cols["Kol5"] = ["2024-03-01", "2024-03-02", "2024-03-02 10:15"]   # datum
+    cols["Kol12"] = [" 1001", "1002 ", "1001"]                        # M = artikelnummer
+    cols["Kol13"] = ["Skruv", "Mutter", "Skruv"]                      # N = artikel
+    df = pd.DataFrame(cols).rename(columns={"Kol3": "Antal", "Kol5": "Datum",
+                                            "Kol12": "Artikelnummer", "Kol13": "Benämning"})
+    df.to_excel(path, index=False, engine="openpyxl")
+
+
+# None = openpyxl-vägen (enda vägen på pandas < 2.2); calamine bara om den finns
+@pytest.mark.parametrize("engine", [None] + ([file_readers._XLSX_ENGINE] if file_readers._XLSX_ENGINE else []))
+def test_read_pick_log_xlsx(tmp_path, monkeypatch, engine):
+    path = str(tmp_path / "plocklogg.xlsx")
+    _write_pick_log_xlsx(path)
+    monkeypatch.setattr(file_readers, "_XLSX_ENGINE", engine)
+
+    out = read_pick_log(path)
+
+    assert list(out.columns) == ["Artikelnummer", "Artikel", "Plockat", "Datum"]
+    assert out["Artikelnummer"].tolist() == ["1001", "1002", "1001"]
+    assert out["Artikel"].tolist() == ["Skruv", "Mutter", "Skruv"]
+    assert out["Plockat"].tolist() == [5.0, 2.5, 1.0]
+    assert out["Datum"].dt.strftime("%Y-%m-%d").tolist() == ["2024-03-01", "2024-03-02", "2024-03-02"]
+
+
+def test_read_excel_fast_openpyxl_header_probe(tmp_path, monkeypatch):
+    path = str(tmp_path / "plocklogg.xlsx")
+    _write_pick_log_xlsx(path)
+    monkeypatch.setattr(file_readers, "_XLSX_ENGINE", None)
+
+    head = file_readers._read_excel_fast(path, nrows=0)
+
+    assert len(head) == 0
+    assert head.columns[12] == "Artikelnummer"